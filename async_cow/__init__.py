@@ -17,4 +17,5 @@ await b.move('a', 'c')
 """
 
 from async_cow.cow import AsyncCow, ClientCow
+from async_cow.auth import AuthRegistry
 
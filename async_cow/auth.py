@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 import asyncio
 import hmac
+import inspect
+import itertools
 import json
 import time
 
@@ -11,14 +13,15 @@ from cachetools import TTLCache
 
 from async_cow import config
 from async_cow.compat import b
-from async_cow.http.aio import CowClientRequest, CowHttpAuthBase
-from async_cow.http.base import RequestBase
-from async_cow.service.storage.upload_progress_recorder import UploadProgressRecorder
-from async_cow.utils import urlsafe_base64_encode, crc32, _file_iter, rfc_from_timestamp
+from async_cow.http.aio import CowClientRequest, CowHttpAuthBase, logger
+from async_cow.http.base import RequestBase, response_status, need_retry
+from async_cow.service.storage.upload_progress_recorder import AsyncUploadProgressRecorder
+from async_cow.utils import urlsafe_base64_encode, crc32_async, rfc_from_timestamp, _BlockPrefetcher, _async_reader
 
 
 TTL = 3500
 CACHE_MAX_SIZE = 2000
+RESUME_EXPIRE_MARGIN = 3600  # 断点续传记录剩余有效期不足该值时不再复用
 
 
 class QiniuAuth(Auth):
@@ -159,6 +162,139 @@ class QiniuMacRequestsAuth(CowHttpAuthBase):
         return r
 
 
+class AuthRegistry(object):
+    """多账号密钥管理类
+
+    维护 access_key 到鉴权对象、bucket 到 access_key 的映射，使多个七牛账号共用同一个 AsyncCow 及其连接池。
+    每个 access_key 持有独立的鉴权对象，因此上传凭证缓存按账号隔离。
+
+    密钥轮换只替换映射关系，已经取得旧鉴权对象或旧凭证的进行中请求不受影响，新的调用自动使用新密钥。
+
+    Usage:
+        registry = AuthRegistry()
+        registry.register(<ACCESS_KEY_A>, <SECRET_KEY_A>, buckets=['bucket-a'])
+        registry.register(<ACCESS_KEY_B>, <SECRET_KEY_B>, buckets=['bucket-b'], default=True)
+        cow = AsyncCow(None, None, auth_registry=registry)
+
+        registry.rotate(<ACCESS_KEY_A>, <NEW_ACCESS_KEY_A>, <NEW_SECRET_KEY_A>)
+
+    Attributes:
+        auth_class:         鉴权类，默认为QiniuAuth
+        max_token_level:    每个账号token缓存数最大水位
+    """
+
+    def __init__(self, auth_class=QiniuAuth, max_token_level=None):
+        self.auth_class = auth_class
+        self.max_token_level = max_token_level
+
+        self._auths = {}
+        self._buckets = {}
+        self._default_access_key = None
+
+    def _create_auth(self, access_key, secret_key):
+
+        if issubclass(self.auth_class, QiniuMacAuth):
+            return self.auth_class(access_key, secret_key)
+
+        return self.auth_class(access_key, secret_key, self.max_token_level)
+
+    def register(self, access_key, secret_key, buckets=None, default=False):
+        """注册一个账号
+
+        Args:
+            access_key: 账号access_key
+            secret_key: 账号secret_key
+            buckets:    归属该账号的空间名列表
+            default:    是否作为未登记空间的默认账号，首个注册的账号自动成为默认账号
+
+        Returns:
+            该账号的鉴权对象
+        """
+        auth = self._auths[access_key] = self._create_auth(access_key, secret_key)
+
+        if buckets:
+            self.bind(access_key, *buckets)
+
+        if default or self._default_access_key is None:
+            self._default_access_key = access_key
+
+        return auth
+
+    def unregister(self, access_key):
+        """注销一个账号，同时解除其所有空间绑定"""
+        auth = self._auths.pop(access_key, None)
+
+        self._buckets = {bucket: ak for bucket, ak in self._buckets.items() if ak != access_key}
+
+        if self._default_access_key == access_key:
+            self._default_access_key = next(iter(self._auths), None)
+
+        return auth
+
+    def bind(self, access_key, *buckets):
+        """将空间绑定到已注册账号"""
+        if access_key not in self._auths:
+            raise KeyError('access_key {0} is not registered'.format(access_key))
+
+        for bucket in buckets:
+            self._buckets[bucket] = access_key
+
+    def rotate(self, access_key, new_access_key, new_secret_key):
+        """密钥轮换
+
+        用新密钥替换旧账号，旧账号绑定的空间全部转移到新密钥上。
+        旧鉴权对象不会被修改，已发出的请求及已签发的凭证在其有效期内继续可用。
+
+        Args:
+            access_key:     被替换的access_key
+            new_access_key: 新的access_key
+            new_secret_key: 新的secret_key
+
+        Returns:
+            新的鉴权对象
+        """
+        if access_key not in self._auths:
+            raise KeyError('access_key {0} is not registered'.format(access_key))
+
+        auth = self._create_auth(new_access_key, new_secret_key)
+
+        # 先登记新密钥再切换映射，任一时刻查询都能得到可用的鉴权对象
+        self._auths[new_access_key] = auth
+        self._buckets = {
+            bucket: (new_access_key if ak == access_key else ak) for bucket, ak in self._buckets.items()
+        }
+        if self._default_access_key == access_key:
+            self._default_access_key = new_access_key
+
+        if new_access_key != access_key:
+            del self._auths[access_key]
+
+        return auth
+
+    def get_auth(self, bucket=None, access_key=None):
+        """获取鉴权对象
+
+        优先按access_key查找，其次按空间查找，都未命中时返回默认账号的鉴权对象
+
+        Args:
+            bucket:     空间名
+            access_key: 账号access_key
+
+        Returns:
+            鉴权对象，没有可用账号时返回None
+        """
+        if access_key is not None:
+            return self._auths.get(access_key)
+
+        return self._auths.get(self._buckets.get(bucket, self._default_access_key))
+
+    def access_keys(self):
+        return list(self._auths.keys())
+
+    def buckets(self):
+        return dict(self._buckets)
+
+
 class _Resume(object):
     """断点续上传类
 
@@ -169,50 +305,76 @@ class _Resume(object):
     Attributes:
         up_token:                   上传凭证
         key:                        上传文件名
-        input_stream:               上传二进制流
-        data_size:                  上传流大小
+        input_stream:               上传二进制流，可以是文件对象、bytes、memoryview或可迭代对象
+        data_size:                  上传流大小，为None时按实际读取的长度mkfile，长度未知、不可seek或未指定modify_time的输入
+                                    不记录断点
         params:                     自定义变量，规格参考 http://developer.qiniu.com/docs/v6/api/overview/up/response/vars.html#xvar
         mime_type:                  上传数据的mimeType
         progress_handler:           上传进度
         upload_progress_recorder:   记录上传进度，用于断点续传
         modify_time:                上传文件修改日期
         hostscache_dir：            host请求 缓存文件保存位置
+        concurrency:                同时上传的块数，块可能乱序完成，mkfile时仍按顺序提交ctx
+        chunk_size:                 块内分片大小，设置后每块先以首片mkblk，其余分片bput，失败时只重传出错的分片，
+                                    为'auto'时根据上传域名的吞吐量估计自动选择
+        read_ahead:                 预读块数，上传当前块时提前读取后续块，默认取config中的upload_read_ahead，
+                                    预读缓冲区的总大小不超过config中的upload_buffer_limit
+        throttle:                   上传限速对象，限速时请求体按令牌匀速写入
     """
 
     def __init__(self, up_token, key, input_stream, file_name, data_size, hostscache_dir, params, mime_type,
-                 progress_handler, upload_progress_recorder, modify_time, keep_last_modified, **settings):
+                 progress_handler, upload_progress_recorder, modify_time, keep_last_modified, concurrency=1,
+                 chunk_size=None, read_ahead=None, throttle=None, **settings):
         """初始化断点续上传"""
         self.up_token = up_token
         self.key = key
-        self.input_stream = input_stream
+        self.input_stream = _async_reader(input_stream)
         self.file_name = file_name
         self.size = data_size
+        # 未指定modify_time的输入（如内存数据）每次上传的记录都不同，无法续传，不记录断点
+        self.resumable = data_size is not None and modify_time is not None and hasattr(self.input_stream, 'seek')
         self.hostscache_dir = hostscache_dir
         self.params = params
         self.mime_type = mime_type
         self.progress_handler = progress_handler
-        self.upload_progress_recorder = upload_progress_recorder or UploadProgressRecorder()
+        self.upload_progress_recorder = upload_progress_recorder or AsyncUploadProgressRecorder()
         self.modify_time = modify_time or time.time()
         self.keep_last_modified = keep_last_modified
+        self.concurrency = max(1, concurrency or 1)
+        self.chunk_size = chunk_size
+        self.read_ahead = config.get_default('upload_read_ahead') if read_ahead is None else read_ahead
+        self.throttle = throttle
 
         if settings.get('http', None):
             self._http = settings.get('http', None)
         else:
             self._http = RequestBase(**settings)
 
-    def record_upload_progress(self, offset):
+    async def record_upload_progress(self, offset):
+        if not self.resumable:
+            return
+
+        # 块可能乱序完成，按块序号记录，未完成的块为None
+        indexes = range(max(self.blockStatus) + 1 if self.blockStatus else 0)
         record_data = {
             'size': self.size,
             'offset': offset,
-            'contexts': [block['ctx'] for block in self.blockStatus]
+            'contexts': [self.blockStatus[i]['ctx'] if i in self.blockStatus else None for i in indexes],
+            'expired_at': [self.blockStatus[i].get('expired_at') if i in self.blockStatus else None for i in indexes]
         }
+        if self._chunk_progress:
+            # 未完成块已上传的分片，key为块序号
+            record_data['chunks'] = {str(index): progress for index, progress in self._chunk_progress.items()}
         if self.modify_time:
             record_data['modify_time'] = self.modify_time
 
-        self.upload_progress_recorder.set_upload_record(self.file_name, self.key, record_data)
+        await self._call_recorder('set_upload_record', record_data)
+
+    async def recovery_from_record(self):
+        if not self.resumable:
+            return 0
 
-    def recovery_from_record(self):
-        record = self.upload_progress_recorder.get_upload_record(self.file_name, self.key)
+        record = await self._call_recorder('get_upload_record')
         if not record:
             return 0
 
@@ -220,47 +382,229 @@ class _Resume(object):
             if not record['modify_time'] or record['size'] != self.size or \
                     record['modify_time'] != self.modify_time:
                 return 0
+            contexts = record['contexts']
         except KeyError:
             return 0
-        self.blockStatus = [{'ctx': ctx} for ctx in record['contexts']]
-        return record['offset']
+
+        # 服务端的块上下文会过期，保留所有仍然有效的块，只重新上传失效或未完成的块
+        deadline = time.time() + RESUME_EXPIRE_MARGIN
+
+        def is_valid(expiry):
+            # 旧格式的记录没有过期时间，视为有效
+            return expiry is None or expiry > deadline
+
+        expired_at = record.get('expired_at') or [None] * len(contexts)
+        self.blockStatus = {
+            index: {'ctx': ctx, 'expired_at': expiry}
+            for index, (ctx, expiry) in enumerate(zip(contexts, expired_at))
+            if ctx and index < self.block_count and is_valid(expiry)
+        }
+        self._chunk_progress = {
+            int(index): progress for index, progress in record.get('chunks', {}).items()
+            if int(index) not in self.blockStatus and is_valid(progress.get('expired_at'))
+        }
+        return sum(self._block_length(index) for index in self.blockStatus)
+
+    async def _call_recorder(self, method, *args):
+        # 兼容同步与异步的上传记录类
+        ret = getattr(self.upload_progress_recorder, method)(self.file_name, self._record_key(), *args)
+        if inspect.isawaitable(ret):
+            ret = await ret
+        return ret
+
+    def _record_key(self):
+        return self.key
+
+    async def _flush_recorder(self):
+        if not self.resumable:
+            return
+        flush = getattr(self.upload_progress_recorder, 'flush', None)
+        if flush is not None:
+            ret = flush()
+            if inspect.isawaitable(ret):
+                await ret
+
+    async def _get_up_host(self):
+        if config.get_default('default_zone').up_host:
+            return config.get_default('default_zone').up_host
+        return await config.get_default('default_zone').get_up_host_by_token(self.up_token, self.hostscache_dir)
+
+    async def _get_up_host_backup(self):
+        if config.get_default('default_zone').up_host_backup:
+            return config.get_default('default_zone').up_host_backup
+        return await config.get_default('default_zone').get_up_host_backup_by_token(self.up_token,
+                                                                                    self.hostscache_dir)
+
+    async def _notify_progress(self, uploaded):
+        if asyncio.iscoroutinefunction(self.progress_handler):
+            await self.progress_handler(uploaded, self.size)
+        elif (callable(self.progress_handler)):
+            self.progress_handler(uploaded, self.size)
+
+    @property
+    def block_count(self):
+        return -(-self.size // config._BLOCK_SIZE)
+
+    def _block_length(self, index):
+        return min(config._BLOCK_SIZE, self.size - index * config._BLOCK_SIZE)
 
     async def upload(self):
         """上传操作"""
-        self.blockStatus = []
-        if config.get_default('default_zone').up_host:
-            host = config.get_default('default_zone').up_host
+        # 已完成的块，key为块序号
+        self.blockStatus = {}
+        self._chunk_progress = {}
+        self._host = await self._get_up_host()
+
+        if self.chunk_size == 'auto':
+            self.chunk_size = self._choose_size(
+                'chunk', config._BLOCK_SIZE, config._CHUNK_SIZE_MIN, config._BLOCK_SIZE, config._CHUNK_SIZE_MIN)
+
+        # 已完成块的总字节数
+        self._uploaded = await self.recovery_from_record()
+        self._failure = None
+
+        if self.size is not None:
+            # 长度已知时只读取未完成的块
+            indexes = [index for index in range(self.block_count) if index not in self.blockStatus]
+            ranges = [(index * config._BLOCK_SIZE, self._block_length(index)) for index in indexes]
+            index = indexes[0] if indexes else self.block_count
         else:
-            host = await config.get_default('default_zone').get_up_host_by_token(self.up_token, self.hostscache_dir)
-
-        offset = self.recovery_from_record()
-        async for block in _file_iter(self.input_stream, config._BLOCK_SIZE, offset):
-            length = len(block)
-            crc = crc32(block)
-            ret, info = await self.make_block(block, length, host)
-            if ret is None and not info.need_retry():
-                return ret, info
-            if info.connect_failed():
-                if config.get_default('default_zone').up_host_backup:
-                    host = config.get_default('default_zone').up_host_backup
-                else:
-                    host = await config.get_default('default_zone').get_up_host_backup_by_token(self.up_token,
-                                                                                          self.hostscache_dir)
-            if info.need_retry() or crc != ret['crc32']:
-                ret, info = await self.make_block(block, length, host)
-                if ret is None or crc != ret['crc32']:
-                    return ret, info
+            indexes, ranges, index = None, None, 0
+
+        self._reader = self._create_reader(config._BLOCK_SIZE, offset=index * config._BLOCK_SIZE, ranges=ranges)
+        await self._dispatch(self._block_indexes(indexes, index), self.blockStatus, self._upload_block)
+
+        if self._failure is not None:
+            # 失败时立即写入上传记录，便于下次续传
+            await self._flush_recorder()
+            return self._failure
 
-            self.blockStatus.append(ret)
-            offset += length
-            self.record_upload_progress(offset)
+        return await self.make_file(self._host)
 
-            if asyncio.iscoroutinefunction(self.progress_handler):
-                await self.progress_handler(((len(self.blockStatus) - 1) * config._BLOCK_SIZE) + length, self.size)
-            elif (callable(self.progress_handler)):
-                self.progress_handler(((len(self.blockStatus) - 1) * config._BLOCK_SIZE) + length, self.size)
+    async def _dispatch(self, positions, completed, upload):
+        """读取self._reader中的数据并发上传:
+
+        同时上传的数量不超过concurrency，已完成的部分直接跳过，出现失败后不再调度新的上传，
+        中途取消或出错时取消所有进行中的上传
+
+        Args:
+            positions:  读取到的数据依次对应的块序号或分片号
+            completed:  已完成的块序号或分片号
+            upload:     上传单个块或分片的协程函数，参数为 (序号, 数据)，失败时设置self._failure，结束时归还缓冲区
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = []
+
+        async def run(position, data):
+            try:
+                await upload(position, data)
+            finally:
+                semaphore.release()
+
+        try:
+            async for data in self._reader:
+                position = next(positions)
+                if position in completed:
+                    self._reader.release(data)
+                    continue
+                await semaphore.acquire()
+                if self._failure is not None:
+                    semaphore.release()
+                    break
+                tasks.append(asyncio.ensure_future(run(position, data)))
+
+            if tasks:
+                await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        finally:
+            await self._reader.close()
+
+    async def _upload_block(self, index, block):
+        try:
+            ret, info = await self._make_block_with_retry(index, block)
+            if ret is None or info.need_retry():
+                if self._failure is None:
+                    self._failure = (ret, info)
+                return
+            await self._complete_block(index, ret, len(block))
+        finally:
+            self._reader.release(block)
+
+    def _create_reader(self, size, offset=0, ranges=None):
+        # 缓冲区需覆盖预读队列、读取中、等待调度以及上传中的块，总大小受upload_buffer_limit限制，
+        # 缓冲区不足时读取等待上传完成归还缓冲区，实际预读及同时上传的块数随之减少
+        buffers = max(1, min(self.read_ahead + self.concurrency + 2, config.get_default('upload_buffer_limit') // size))
+        read_ahead = min(self.read_ahead, max(0, buffers - self.concurrency - 2))
+        return _BlockPrefetcher(self.input_stream, size, offset=offset, read_ahead=read_ahead, buffers=buffers,
+                                ranges=ranges)
+
+    def _block_indexes(self, indexes, start):
+        # 读取到的块依次对应的块序号
+        return iter(indexes) if indexes is not None else itertools.count(start)
+
+    async def _make_block_with_retry(self, index, block):
+        length = len(block)
+        chunk_size = self.chunk_size or length
+
+        # 从上传记录恢复块内已完成的分片，服务端返回701（ctx失效）时整块重传
+        progress = self._chunk_progress.get(index)
+        if progress:
+            ret, info = await self._make_chunks(index, block, chunk_size, progress['ctx'], progress['offset'])
+            if ret is not None or response_status(info) != 701:
+                return ret, info
+            # 失效的ctx不能留在上传记录中，否则之后的续传同样会失败
+            self._chunk_progress.pop(index, None)
+            await self.record_upload_progress(self._uploaded)
+
+        return await self._make_chunks(index, block, chunk_size)
+
+    async def _make_chunks(self, index, block, chunk_size, ctx=None, offset=0):
+        length = len(block)
+        view = memoryview(block)
+        ret, info = None, None
+
+        while offset < length:
+            chunk = view[offset:offset + chunk_size]
+            crc = await self._chunk_crc(index, offset, chunk)
+            if ctx is None:
+                ret, info = await self._send_chunk(chunk, crc, self.block_url, length)
+            else:
+                ret, info = await self._send_chunk(chunk, crc, self.chunk_url, ctx, offset)
+            if ret is None:
+                return ret, info
 
-        return await self.make_file(host)
+            ctx, offset = ret['ctx'], ret.get('offset', offset + len(chunk))
+            if offset < length:
+                self._chunk_progress[index] = {'ctx': ctx, 'offset': offset, 'expired_at': ret.get('expired_at')}
+                await self.record_upload_progress(self._uploaded)
+
+        self._chunk_progress.pop(index, None)
+        return ret, info
+
+    async def _chunk_crc(self, index, offset, chunk):
+        return await crc32_async(chunk, config.get_default('checksum_executor'),
+                                 config.get_default('checksum_inline_threshold'))
+
+    async def _send_chunk(self, chunk, crc, url_func, *url_args):
+        ret, info = await self.post(url_func(self._host, *url_args), chunk)
+        if ret is None and not need_retry(info):
+            return ret, info
+        if info.connect_failed():
+            self._host = await self._get_up_host_backup()
+        if ret is None or crc != ret['crc32']:
+            ret, info = await self.post(url_func(self._host, *url_args), chunk)
+            if ret is None or crc != ret['crc32']:
+                return None, info
+        return ret, info
+
+    async def _complete_block(self, index, ret, length):
+        self.blockStatus[index] = ret
+        self._uploaded += length
+        await self.record_upload_progress(self._uploaded)
+        await self._notify_progress(self._uploaded)
 
     async def make_block(self, block, block_size, host):
         """创建块"""
@@ -270,8 +614,13 @@ class _Resume(object):
     def block_url(self, host, size):
         return '{0}/mkblk/{1}'.format(host, size)
 
+    def chunk_url(self, host, ctx, offset):
+        return '{0}/bput/{1}/{2}'.format(host, ctx, offset)
+
     def file_url(self, host):
-        url = ['{0}/mkfile/{1}'.format(host, self.size)]
+        # 长度未知的流在所有块完成后按实际长度提交
+        size = self.size if self.size is not None else self._uploaded
+        url = ['{0}/mkfile/{1}'.format(host, size)]
 
         if self.mime_type:
             url.append('mimeType/{0}'.format(urlsafe_base64_encode(self.mime_type)))
@@ -298,9 +647,270 @@ class _Resume(object):
     async def make_file(self, host):
         """创建文件"""
         url = self.file_url(host)
-        body = ','.join([status['ctx'] for status in self.blockStatus])
-        self.upload_progress_recorder.delete_upload_record(self.file_name, self.key)
+        body = ','.join([self.blockStatus[index]['ctx'] for index in sorted(self.blockStatus)])
+        if self.resumable:
+            await self._call_recorder('delete_upload_record')
         return await self.post(url, body)
 
     async def post(self, url, data):
-        return await self._http._post_with_token(url, data, self.up_token)
+        return await self._observe(len(data) if data else 0,
+                                   self._http._post_with_token(url, self._body(data), self.up_token))
+
+    def _body(self, data):
+        return self.throttle.wrap(data) if self.throttle is not None else data
+
+    async def _observe(self, size, request):
+        # 统计上传域名的吞吐量，非网络原因的失败及取消的请求不计入
+        host = self._host
+        estimator = config.get_default('throughput_estimator')
+        token = estimator.begin(host)
+        ret = info = None
+        try:
+            ret, info = await request
+            return ret, info
+        finally:
+            success = None
+            if info is not None and (ret is not None or need_retry(info)):
+                success = ret is not None
+            estimator.end(host, token, size, success, throttled=self.throttle is not None and self.throttle.limited)
+
+    def _choose_size(self, kind, default, minimum, maximum, align):
+        estimator = config.get_default('throughput_estimator')
+        size = estimator.choose_size(self._host, default, minimum, maximum, align, kind=kind)
+        logger.debug(f'{kind} size {size} for {self._host} => {estimator.stats(self._host)}')
+        return size
+
+
+class _FanoutResume(_Resume):
+    """共享读取的断点续上传类
+
+    多个目标上传同一文件时，每个目标一个该类的对象，块数据由同一个 _BlockFanout 读取并分发，crc32只计算一次。
+    不同空间中的同名文件各自记录上传进度
+
+    Attributes:
+        fanout: _BlockFanout对象
+    """
+
+    def __init__(self, fanout, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fanout = fanout
+        self.bucket = config.get_default('default_zone').unmarshal_up_token(self.up_token)[1]
+        self._subscribed = False
+
+    async def upload(self):
+        try:
+            return await super().upload()
+        finally:
+            if not self._subscribed:
+                self.fanout.leave()
+
+    def _create_reader(self, size, offset=0, ranges=None):
+        # 共享读取从第一个未完成的块开始顺序分发，其后已完成的块在upload中跳过
+        self._subscribed = True
+        return self.fanout.subscribe(offset)
+
+    def _block_indexes(self, indexes, start):
+        return itertools.count(start)
+
+    async def _chunk_crc(self, index, offset, chunk):
+        return await self.fanout.crc32(index, offset, chunk, config.get_default('checksum_executor'),
+                                       config.get_default('checksum_inline_threshold'))
+
+    def _record_key(self):
+        return '{0}:{1}'.format(self.bucket, self.key)
+
+
+class _ResumeV2(_Resume):
+    """分片上传v2类
+
+    基于 initParts/uploadPart/completeParts 接口实现分片上传，分片大小可在1MB至1GB之间配置，详细规格参考：
+    https://developer.qiniu.com/kodo/6364/multipartupload-interface
+
+    与v1不同，每个分片独立提交，上传记录中保存所有已完成分片的etag，恢复时只补传缺失的分片。
+
+    Attributes:
+        part_size:  分片大小，默认为4MB，分片数超过10000时自动增大；为'auto'时根据上传域名的吞吐量估计自动选择，
+                    续传时沿用上传记录中的分片大小
+    """
+
+    def __init__(self, up_token, key, input_stream, file_name, data_size, hostscache_dir, params, mime_type,
+                 progress_handler, upload_progress_recorder, modify_time, keep_last_modified, concurrency=1,
+                 part_size=None, **settings):
+        """初始化分片上传v2"""
+        if data_size is None:
+            raise ValueError('data_size is required for resumable upload v2')
+
+        super().__init__(up_token, key, input_stream, file_name, data_size, hostscache_dir, params, mime_type,
+                         progress_handler, upload_progress_recorder, modify_time, keep_last_modified,
+                         concurrency=concurrency, **settings)
+
+        self.auto_part_size = part_size == 'auto'
+        if part_size is None or self.auto_part_size:
+            part_size = config._BLOCK_SIZE
+
+        if part_size < config._PART_SIZE_MIN or part_size > config._PART_SIZE_MAX:
+            raise ValueError('part_size must be between {0} and {1}'.format(
+                config._PART_SIZE_MIN, config._PART_SIZE_MAX))
+
+        self.part_size = self._fit_part_size(part_size)
+        self.bucket = config.get_default('default_zone').unmarshal_up_token(up_token)[1]
+
+        self.upload_id = None
+        self.expired_at = None
+
+    def _fit_part_size(self, part_size):
+        # 分片数不能超过接口上限，按MB对齐增大分片
+        min_part_size = -(-self.size // config._PART_NUMBER_MAX)
+        if part_size < min_part_size:
+            part_size = -(-min_part_size // config._PART_SIZE_MIN) * config._PART_SIZE_MIN
+        return part_size
+
+    @property
+    def part_count(self):
+        return max(1, -(-self.size // self.part_size))
+
+    def _part_length(self, part_number):
+        return min(self.part_size, self.size - (part_number - 1) * self.part_size)
+
+    async def record_upload_progress(self, offset=None):
+        if not self.resumable:
+            return
+
+        record_data = {
+            'size': self.size,
+            'part_size': self.part_size,
+            'upload_id': self.upload_id,
+            'expired_at': self.expired_at,
+            'etags': [{'partNumber': num, 'etag': etag} for num, etag in sorted(self._parts.items())]
+        }
+        if self.modify_time:
+            record_data['modify_time'] = self.modify_time
+
+        await self._call_recorder('set_upload_record', record_data)
+
+    async def recovery_from_record(self):
+        if not self.resumable:
+            return False
+
+        record = await self._call_recorder('get_upload_record')
+        if not record:
+            return False
+
+        try:
+            if self.auto_part_size and \
+                    config._PART_SIZE_MIN <= record['part_size'] <= config._PART_SIZE_MAX:
+                self.part_size = self._fit_part_size(record['part_size'])
+            if not record['modify_time'] or record['size'] != self.size or \
+                    record['modify_time'] != self.modify_time or record['part_size'] != self.part_size:
+                return False
+            # 临近过期的uploadId不再复用，避免completeParts时失败
+            if not record['upload_id'] or record['expired_at'] <= time.time() + RESUME_EXPIRE_MARGIN:
+                return False
+            etags = record['etags']
+        except KeyError:
+            return False
+
+        self.upload_id = record['upload_id']
+        self.expired_at = record['expired_at']
+        self._parts = {item['partNumber']: item['etag'] for item in etags}
+        return True
+
+    async def upload(self):
+        """上传操作"""
+        self._host = await self._get_up_host()
+        self._parts = {}
+        self._failure = None
+
+        if not await self.recovery_from_record():
+            self._parts = {}
+            if self.auto_part_size:
+                self.part_size = self._fit_part_size(self._choose_size(
+                    'part', config._BLOCK_SIZE, config._PART_SIZE_MIN, config._AUTO_PART_SIZE_MAX,
+                    config._PART_SIZE_MIN))
+            ret, info = await self.init_parts()
+            if ret is None:
+                return ret, info
+            self.upload_id = ret['uploadId']
+            self.expired_at = ret['expireAt']
+
+        self._uploaded = sum(self._part_length(num) for num in self._parts)
+
+        part_numbers = [num for num in range(1, self.part_count + 1) if num not in self._parts]
+        self._reader = self._create_reader(
+            self.part_size,
+            ranges=[((num - 1) * self.part_size, self._part_length(num)) for num in part_numbers]
+        )
+        await self._dispatch(iter(part_numbers), self._parts, self._upload_part)
+
+        if self._failure is not None:
+            # 失败时立即写入上传记录，便于下次续传
+            await self._flush_recorder()
+            return self._failure
+
+        return await self.complete_parts()
+
+    async def _upload_part(self, part_number, part):
+        try:
+            ret, info = await self.upload_part(part_number, part)
+            if ret is None and need_retry(info):
+                if info.connect_failed():
+                    self._host = await self._get_up_host_backup()
+                ret, info = await self.upload_part(part_number, part)
+            if ret is None:
+                if self._failure is None:
+                    self._failure = (ret, info)
+                return
+
+            self._parts[part_number] = ret['etag']
+            await self.record_upload_progress()
+
+            self._uploaded += len(part)
+            await self._notify_progress(self._uploaded)
+        finally:
+            self._reader.release(part)
+
+    def parts_url(self, host):
+        encoded_key = '~' if self.key is None else urlsafe_base64_encode(self.key)
+        return '{0}/buckets/{1}/objects/{2}/uploads'.format(host, self.bucket, encoded_key)
+
+    async def init_parts(self):
+        """初始化分片上传任务"""
+        return await self._observe(0, self._http._post_with_token(self.parts_url(self._host), None, self.up_token))
+
+    async def upload_part(self, part_number, part):
+        """上传分片"""
+        url = '{0}/{1}/{2}'.format(self.parts_url(self._host), self.upload_id, part_number)
+        return await self._observe(len(part), self._http._put_with_token(
+            url, self._body(part), self.up_token, {'Content-Type': 'application/octet-stream'}))
+
+    async def complete_parts(self):
+        """完成分片上传，合并为文件"""
+        body = {
+            'parts': [{'partNumber': num, 'etag': etag} for num, etag in sorted(self._parts.items())],
+        }
+        if self.file_name is not None:
+            body['fname'] = self.file_name
+        if self.mime_type:
+            body['mimeType'] = self.mime_type
+
+        metadata = {}
+        custom_vars = {}
+        if self.params:
+            for k, v in self.params.items():
+                if k.startswith('x-qn-meta-'):
+                    metadata[k] = v
+                else:
+                    custom_vars[k] = v
+        if self.modify_time and self.keep_last_modified:
+            metadata['x-qn-meta-!Last-Modified'] = rfc_from_timestamp(self.modify_time)
+        if metadata:
+            body['metadata'] = metadata
+        if custom_vars:
+            body['customVars'] = custom_vars
+
+        url = '{0}/{1}'.format(self.parts_url(self._host), self.upload_id)
+        ret, info = await self._http._post_with_token_and_headers(
+            url, json.dumps(body), self.up_token, {'Content-Type': 'application/json'})
+        if ret is not None:
+            await self._call_recorder('delete_upload_record')
+        return ret, info
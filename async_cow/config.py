@@ -8,6 +8,13 @@ UC_HOST = 'https://uc.qbox.me'  # 获取空间信息Host
 
 _BLOCK_SIZE = 1024 * 1024 * 4  # 断点续上传分块大小，该参数为接口规格，暂不支持修改
 
+_PART_SIZE_MIN = 1024 * 1024  # 分片上传v2最小分片大小
+_PART_SIZE_MAX = 1024 * 1024 * 1024  # 分片上传v2最大分片大小
+_PART_NUMBER_MAX = 10000  # 分片上传v2最大分片数
+
+_CHUNK_SIZE_MIN = 1024 * 256  # 自适应分片时v1块内分片的最小大小
+_AUTO_PART_SIZE_MAX = 1024 * 1024 * 64  # 自适应分片时v2分片的最大大小，限制预读缓冲占用的内存
+
 _config = {
     'default_zone': zone.Zone(),
     'default_rs_host': RS_HOST,
@@ -17,17 +24,45 @@ _config = {
     'connection_timeout': 30,  # 链接超时为时间为30s
     'connection_retries': 3,  # 链接重试次数为3次
     'connection_pool': 10,  # 链接池个数为10
+    'upload_read_ahead': 2,  # 分块上传预读块数
+    'upload_buffer_limit': 1024 * 1024 * 256,  # 单次分块上传预读缓冲区的总字节数上限，至少保留一个块
+    'checksum_executor': None,  # 计算crc32及etag的执行器，None为事件循环默认线程池
+    'checksum_inline_threshold': 1024 * 64,  # 不超过该大小的数据直接在事件循环中计算crc32
+    'compress_executor': None,  # 上传时压缩数据的执行器，None为事件循环默认线程池
+    'throughput_estimator': None,  # 按上传域名统计吞吐量，用于自适应分片，首次使用时创建
+    'upload_throttle': None,  # 进程级上传限速，默认不限速，首次使用时创建
+}
+
+
+def _create_throughput_estimator():
+    from async_cow.service.storage.throughput import ThroughputEstimator
+    return ThroughputEstimator()
+
+
+def _create_upload_throttle():
+    from async_cow.service.storage.throttle import TokenBucket
+    return TokenBucket()
+
+
+# 依赖service层的默认对象在首次使用时创建，config不导入上层模块
+_LAZY_DEFAULTS = {
+    'throughput_estimator': _create_throughput_estimator,
+    'upload_throttle': _create_upload_throttle,
 }
 
 
 def get_default(key):
+    if _config[key] is None and key in _LAZY_DEFAULTS:
+        _config[key] = _LAZY_DEFAULTS[key]()
     return _config[key]
 
 
 def set_default(
         default_zone=None, connection_retries=None, connection_pool=None,
         connection_timeout=None, default_rs_host=None, default_uc_host=None,
-        default_rsf_host=None, default_api_host=None):
+        default_rsf_host=None, default_api_host=None, upload_read_ahead=None, upload_buffer_limit=None,
+        checksum_executor=None, checksum_inline_threshold=None, throughput_estimator=None,
+        upload_rate_limit=None, compress_executor=None):
     if default_zone:
         _config['default_zone'] = default_zone
     if default_rs_host:
@@ -44,3 +79,18 @@ def set_default(
         _config['connection_pool'] = connection_pool
     if connection_timeout:
         _config['connection_timeout'] = connection_timeout
+    if upload_read_ahead is not None:
+        _config['upload_read_ahead'] = upload_read_ahead
+    if upload_buffer_limit:
+        _config['upload_buffer_limit'] = upload_buffer_limit
+    if checksum_executor:
+        _config['checksum_executor'] = checksum_executor
+    if checksum_inline_threshold is not None:
+        _config['checksum_inline_threshold'] = checksum_inline_threshold
+    if compress_executor:
+        _config['compress_executor'] = compress_executor
+    if throughput_estimator:
+        _config['throughput_estimator'] = throughput_estimator
+    if upload_rate_limit is not None:
+        # 调整进程级令牌桶的速率，已创建的限速对象同样生效，0取消限速
+        get_default('upload_throttle').set_rate(upload_rate_limit)
@@ -1,18 +1,34 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
+import mmap
 import os
 
+from qiniu.http import ResponseInfo
+
 from async_cow import config
-from async_cow.auth import QiniuAuth, _Resume, QiniuMacAuth
-from async_cow.http.base import RequestBase
+from async_cow.compat import b
+from async_cow.auth import QiniuAuth, _Resume, _ResumeV2, _FanoutResume, QiniuMacAuth
+from async_cow.http.base import RequestBase, NETWORK_ERRORS
 from async_cow.service.cdn.manager import CdnManager, DomainManager
 from async_cow.service.compute.app import AccountClient
 from async_cow.service.compute.qcos_api import QcosClient
 from async_cow.service.pili.rtc_server_manager import RtcServer
 from async_cow.service.processing.pfop import PersistentFop
 from async_cow.service.storage.bucket import Bucket
+from async_cow.service.storage.content import ExistenceCache
+from async_cow.service.storage.throttle import TokenBucket, Throttle
 from async_cow.service.sms.sms import Sms
-from async_cow.utils import crc32, file_crc32, rfc_from_timestamp
+from async_cow.utils import crc32_async, rfc_from_timestamp, _async_reader, _iter_stream, _BlockFanout, \
+    _compressor, _compress_params, _compress_stream, _check_compress_options
+
+
+async def _network_errors_as_info(coro):
+    # 网络错误转换为 (None, ResponseInfo)，与上传失败的返回值一致
+    try:
+        return await coro
+    except NETWORK_ERRORS as e:
+        return None, ResponseInfo(None, e)
 
 
 class _BaseCow:
@@ -26,7 +42,10 @@ class _BaseCow:
                  **settings
                  ):
 
-        if issubclass(auth_class, QiniuMacAuth):
+        if access_key is None:
+            # 由AuthRegistry提供鉴权对象
+            self._auth = None
+        elif issubclass(auth_class, QiniuMacAuth):
             self._auth = auth_class(access_key, secret_key)
         elif issubclass(auth_class, QiniuAuth):
             self._auth = auth_class(access_key, secret_key, max_token_level)
@@ -58,7 +77,13 @@ class AsyncCow(_BaseCow):
                  cdn_manager_class=CdnManager,
                  domain_manager_class=DomainManager,
                  request_class=RequestBase,
+                 auth_registry=None,
+                 upload_rate_limit=None,
                  **settings):
+        """
+        :param auth_registry: AuthRegistry 对象，多账号时按空间选择鉴权对象，此时access_key、secret_key可以为None
+        :param upload_rate_limit: 当前对象所有上传的总速率上限，单位为字节/秒，默认不限速，0同样表示不限速
+        """
 
         super().__init__(
             access_key,
@@ -77,6 +102,94 @@ class AsyncCow(_BaseCow):
         self._cdn_manager_class = cdn_manager_class
         self._domain_manager_class = domain_manager_class
 
+        self._auth_registry = auth_registry
+
+        self._upload_throttle = TokenBucket(upload_rate_limit)
+        self._bucket_throttles = {}
+        self._tenant_throttles = {}
+
+        self._existence_caches = {}
+
+    @property
+    def auth(self):
+        # 配置了auth_registry时为默认账号的鉴权对象，供CDN、持久化处理、短信等服务使用
+        return self.get_auth()
+
+    @property
+    def auth_registry(self):
+        return self._auth_registry
+
+    def get_auth(self, bucket=None):
+        """
+        获取空间对应的鉴权对象
+        配置了auth_registry时按空间查找，未命中则回退到构造时传入的密钥
+        """
+        if self._auth_registry is not None:
+            auth = self._auth_registry.get_auth(bucket)
+            if auth is not None:
+                return auth
+
+        return self._auth
+
+    def get_access_key(self, bucket=None):
+
+        return self.get_auth(bucket).get_access_key()
+
+    def set_upload_rate_limit(self, rate, bucket=None, tenant=None, burst=None):
+        """
+        设置上传限速，可在运行时调整，对之后写入的数据立即生效
+        指定bucket或tenant时设置该空间或租户标签的限速，否则设置当前对象的总限速；进程级限速通过config.set_default设置
+
+        Args:
+            rate:   每秒字节数，为None或0时取消限速
+            bucket: 空间名
+            tenant: 租户标签，上传时通过tenant参数指定
+            burst:  最多积累的令牌数，默认为一秒的流量
+        """
+        if bucket is not None and tenant is not None:
+            raise ValueError('bucket and tenant can not be both specified')
+
+        if tenant is not None:
+            throttles, name = self._tenant_throttles, tenant
+        elif bucket is not None:
+            throttles, name = self._bucket_throttles, bucket
+        else:
+            self._upload_throttle.set_rate(rate, burst)
+            return
+
+        if name in throttles:
+            throttles[name].set_rate(rate, burst)
+        else:
+            throttles[name] = TokenBucket(rate, burst)
+
+    def get_upload_throttle(self, bucket=None, tenant=None):
+        """
+        获取上传限速对象，写入时同时受租户、空间、当前对象及进程的限速约束
+        """
+        return Throttle(self._tenant_throttles.get(tenant), self._bucket_throttles.get(bucket),
+                        self._upload_throttle, config.get_default('upload_throttle'))
+
+    def _get_token_throttle(self, up_token, tenant=None):
+        bucket = None
+        if self._bucket_throttles:
+            bucket = config.get_default('default_zone').unmarshal_up_token(up_token)[1]
+        return self.get_upload_throttle(bucket, tenant)
+
+    def set_existence_cache(self, bucket, cache):
+        """
+        设置空间的已存在文件缓存，用于按内容etag命名的上传，可传入带布隆过滤器的ExistenceCache，release时写回布隆过滤器
+        """
+        self._existence_caches[bucket] = cache
+
+    def get_existence_cache(self, bucket):
+        """
+        获取空间的已存在文件缓存，未设置时创建一个只有进程内LRU的缓存
+        """
+        cache = self._existence_caches.get(bucket)
+        if cache is None:
+            cache = self._existence_caches[bucket] = ExistenceCache()
+        return cache
+
     def get_bucket(self, bucket):
         """
         推荐使用此方法得到一个bucket对象,
@@ -119,6 +232,9 @@ class AsyncCow(_BaseCow):
 
     async def release(self):
 
+        # 写回已存在文件缓存的布隆过滤器
+        for cache in self._existence_caches.values():
+            cache.save()
         await self._http.close()
 
     def get_token(self,
@@ -138,7 +254,7 @@ class AsyncCow(_BaseCow):
         Returns:
             上传凭证
         """
-        return self._auth.get_token(bucket, key, policy, strict_policy)
+        return self.get_auth(bucket).get_token(bucket, key, policy, strict_policy)
 
     def get_rtc_room_token(self, room_access):
         """
@@ -146,7 +262,7 @@ class AsyncCow(_BaseCow):
         同官方SDK中 get_room_token 加以缓存管理
         from qiniu.services.pili.rtc_server_manager import get_room_token
         """
-        return self._auth.get_rtc_room_token(room_access)
+        return self.get_auth().get_rtc_room_token(room_access)
 
     async def put_data(self,
                        up_token,
@@ -157,38 +273,70 @@ class AsyncCow(_BaseCow):
                        check_crc=False,
                        progress_handler=None,
                        fname=None,
-                       hostscache_dir=None):
+                       hostscache_dir=None,
+                       concurrency=1,
+                       tenant=None,
+                       compress=None):
         """上传二进制流到七牛
 
+        数据不超过两个块（8MB）时使用表单上传，否则自动转为分块上传，
+        文件对象及可迭代对象以流的方式读取，内存中只保留少量的块
+
         Args:
             up_token:         上传凭证
             key:              上传文件名
-            data:             上传二进制流
+            data:             上传二进制流，可以是 bytes/bytearray/memoryview、同步或异步的文件对象、同步或异步可迭代对象
             params:           自定义变量，规格参考 http://developer.qiniu.com/docs/v6/api/overview/up/response/vars.html#xvar
             mime_type:        上传数据的mimeType
             check_crc:        是否校验crc32
             progress_handler: 上传进度回调函数，可以是协程函数，也可以是普通函数或方法
             hostscache_dir：  host请求 缓存文件保存位置
+            concurrency:      分块上传时同时上传的块数
+            tenant:           租户标签，用于上传限速
+            compress:         上传前压缩，'gzip' 或 'zstd'（需安装zstandard），
+                              压缩后长度未知，按流式上传处理，并通过 x-qn-meta-Content-Encoding 记录压缩算法。
+                              空间中保存的是压缩后的数据，下载时不会自动解压，需由下载方按该元数据自行解压
 
         Returns:
             一个dict变量，类似 {"hash": "<Hash string>", "key": "<Key string>"}
             一个ResponseInfo对象
         """
 
-        final_data = b''
-        if hasattr(data, 'read'):
-            while True:
-                tmp_data = data.read(config._BLOCK_SIZE)
-                if len(tmp_data) == 0:
-                    break
-                else:
-                    final_data += tmp_data
+        threshold = config._BLOCK_SIZE * 2
+
+        if compress:
+            params = _compress_params(params, compress)
+            data = _compress_stream(data, _compressor(compress), config.get_default('compress_executor'))
+
+        if isinstance(data, (str, bytes, bytearray, memoryview)):
+            final_data = b(data)
+            if len(final_data) > threshold:
+                return await self.put_stream(up_token, key, final_data, fname, len(final_data), hostscache_dir,
+                                             params, mime_type, progress_handler, concurrency=concurrency,
+                                             tenant=tenant)
         else:
-            final_data = data
+            # 先读取不超过阈值的数据，读完即表单上传，否则连同剩余数据转为分块上传
+            reader = _async_reader(data)
+            chunks = []
+            length = 0
+            while length <= threshold:
+                chunk = await reader.read(config._BLOCK_SIZE)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                length += len(chunk)
+
+            if length > threshold:
+                return await self.put_stream(up_token, key, _iter_stream(reader, config._BLOCK_SIZE, chunks), fname,
+                                             None, hostscache_dir, params, mime_type, progress_handler,
+                                             concurrency=concurrency, tenant=tenant)
 
-        crc = crc32(final_data)
+            final_data = b''.join(chunks)
+
+        crc = await crc32_async(final_data, config.get_default('checksum_executor'),
+                                config.get_default('checksum_inline_threshold'))
         return await self._form_put(up_token, key, final_data, params, mime_type, crc, hostscache_dir, progress_handler,
-                                    fname)
+                                    fname, throttle=self._get_token_throttle(up_token, tenant))
 
     async def put_file(self,
                        up_token,
@@ -200,7 +348,14 @@ class AsyncCow(_BaseCow):
                        progress_handler=None,
                        upload_progress_recorder=None,
                        keep_last_modified=False,
-                       hostscache_dir=None):
+                       hostscache_dir=None,
+                       concurrency=1,
+                       version='v1',
+                       part_size=None,
+                       chunk_size=None,
+                       use_mmap=False,
+                       tenant=None,
+                       compress=None):
 
         """上传文件到七牛
 
@@ -214,6 +369,15 @@ class AsyncCow(_BaseCow):
             progress_handler:         上传进度，可以是协程函数，也可以是普通函数或方法
             upload_progress_recorder: 记录上传进度，用于断点续传
             hostscache_dir：          host请求 缓存文件保存位置
+            concurrency:              分块上传时同时上传的块数
+            version:                  分片上传版本，v1 为 mkblk/mkfile，v2 为 uploads/parts
+            part_size:                v2 分片大小，1MB 至 1GB，默认4MB，为'auto'时根据实测吞吐量自动选择
+            chunk_size:               v1 块内分片大小，弱网环境下失败只重传出错的分片，为'auto'时根据实测吞吐量自动选择
+            use_mmap:                 分块上传时将文件映射到内存，直接以memoryview切片作为请求体，省去每块的内存分配和拷贝
+            tenant:                   租户标签，用于上传限速
+            compress:                 上传前压缩，'gzip' 或 'zstd'，见 put_data；压缩后长度未知，
+                                      不能同时指定 upload_progress_recorder、keep_last_modified、v2、part_size、
+                                      chunk_size 或 use_mmap，否则抛出ValueError
 
         Returns:
             一个dict变量，类似 {"hash": "<Hash string>", "key": "<Key string>"}
@@ -221,6 +385,24 @@ class AsyncCow(_BaseCow):
         """
         ret = {}
         size = os.stat(file_path).st_size
+
+        if compress:
+            _check_compress_options(upload_progress_recorder=upload_progress_recorder,
+                                    keep_last_modified=keep_last_modified, version=version != 'v1',
+                                    part_size=part_size, chunk_size=chunk_size, use_mmap=use_mmap)
+            import aiofiles
+            async with aiofiles.open(file_path, mode='rb') as input_stream:
+                return await self.put_data(up_token, key, input_stream, params, mime_type,
+                                           progress_handler=progress_handler, fname=os.path.basename(file_path),
+                                           hostscache_dir=hostscache_dir, concurrency=concurrency, tenant=tenant,
+                                           compress=compress)
+
+        if use_mmap and size > config._BLOCK_SIZE * 2:
+            return await self._put_file_mmap(up_token, key, file_path, size, params, mime_type, progress_handler,
+                                             upload_progress_recorder, keep_last_modified, hostscache_dir,
+                                             concurrency=concurrency, version=version, part_size=part_size,
+                                             chunk_size=chunk_size, tenant=tenant)
+
         import aiofiles
         async with aiofiles.open(file_path, mode='rb') as input_stream:
             file_name = os.path.basename(file_path)
@@ -229,18 +411,114 @@ class AsyncCow(_BaseCow):
                 ret, info = await self.put_stream(up_token, key, input_stream, file_name, size, hostscache_dir, params,
                                                   mime_type, progress_handler,
                                                   upload_progress_recorder=upload_progress_recorder,
-                                                  modify_time=modify_time, keep_last_modified=keep_last_modified)
+                                                  modify_time=modify_time, keep_last_modified=keep_last_modified,
+                                                  concurrency=concurrency, version=version, part_size=part_size,
+                                                  chunk_size=chunk_size, tenant=tenant)
             else:
-                crc = file_crc32(file_path)
-                ret, info = await self._form_put(up_token, key, input_stream, params, mime_type,
+                # 小文件只读取一次，同一份数据既用于计算crc32也作为表单上传的内容
+                data = await input_stream.read()
+                crc = await crc32_async(data, config.get_default('checksum_executor'),
+                                        config.get_default('checksum_inline_threshold'))
+                ret, info = await self._form_put(up_token, key, data, params, mime_type,
                                                  crc, hostscache_dir, progress_handler, file_name,
-                                                 modify_time=modify_time, keep_last_modified=keep_last_modified)
+                                                 modify_time=modify_time, keep_last_modified=keep_last_modified,
+                                                 throttle=self._get_token_throttle(up_token, tenant))
         return ret, info
 
+    async def put_file_multi(self,
+                             targets,
+                             file_path,
+                             params=None,
+                             mime_type='application/octet-stream',
+                             upload_progress_recorder=None,
+                             keep_last_modified=False,
+                             hostscache_dir=None,
+                             concurrency=1,
+                             chunk_size=None,
+                             tenant=None):
+
+        """同一文件同时上传到多个空间
+
+        文件只读取一次，每块的crc32只计算一次，再分发给各目标的分块上传任务并发上传，适用于主备空间等多副本场景。
+        各目标独立记录断点，任一目标上传失败或出现网络错误不影响其它目标，其它异常取消所有目标后抛出；读取速度受最慢的目标约束
+
+        Args:
+            targets:                  (bucket, key) 列表
+            file_path:                上传文件的路径
+            params:                   自定义变量，规格参考 http://developer.qiniu.com/docs/v6/api/overview/up/response/vars.html#xvar
+            mime_type:                上传数据的mimeType
+            upload_progress_recorder: 记录上传进度，用于断点续传
+            hostscache_dir：          host请求 缓存文件保存位置
+            concurrency:              每个目标同时上传的块数
+            chunk_size:               v1 块内分片大小
+            tenant:                   租户标签，用于上传限速
+
+        Returns:
+            一个list变量，与targets一一对应，每项为 (ret, info)
+        """
+        size = os.stat(file_path).st_size
+        file_name = os.path.basename(file_path)
+        modify_time = int(os.path.getmtime(file_path))
+        tokens = [self.get_token(bucket, key) for bucket, key in targets]
+
+        import aiofiles
+        async with aiofiles.open(file_path, mode='rb') as input_stream:
+            if size > config._BLOCK_SIZE * 2:
+                read_ahead = config.get_default('upload_read_ahead')
+                fanout = _BlockFanout(_async_reader(input_stream), config._BLOCK_SIZE, len(targets),
+                                      read_ahead=read_ahead, buffers=read_ahead + concurrency + 3)
+                tasks = [
+                    _FanoutResume(fanout, token, key, input_stream, file_name, size, hostscache_dir, params,
+                                  mime_type, None, upload_progress_recorder, modify_time, keep_last_modified,
+                                  concurrency=concurrency, chunk_size=chunk_size,
+                                  throttle=self._get_token_throttle(token, tenant), http=self.http).upload()
+                    for token, (_, key) in zip(tokens, targets)
+                ]
+            else:
+                data = await input_stream.read()
+                crc = await crc32_async(data, config.get_default('checksum_executor'),
+                                        config.get_default('checksum_inline_threshold'))
+                tasks = [
+                    self._form_put(token, key, data, params, mime_type, crc, hostscache_dir, None, file_name,
+                                   modify_time=modify_time, keep_last_modified=keep_last_modified,
+                                   throttle=self._get_token_throttle(token, tenant))
+                    for token, (_, key) in zip(tokens, targets)
+                ]
+            # 网络错误只影响对应的目标，其它异常取消所有目标后抛出
+            futures = [asyncio.ensure_future(_network_errors_as_info(task)) for task in tasks]
+            try:
+                return await asyncio.gather(*futures)
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    async def _put_file_mmap(self, up_token, key, file_path, size, params, mime_type, progress_handler,
+                             upload_progress_recorder, keep_last_modified, hostscache_dir, **settings):
+
+        with open(file_path, 'rb') as stream:
+            mapped = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if hasattr(mapped, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+
+        try:
+            return await self.put_stream(up_token, key, memoryview(mapped), os.path.basename(file_path), size,
+                                         hostscache_dir, params, mime_type, progress_handler,
+                                         upload_progress_recorder=upload_progress_recorder,
+                                         modify_time=int(os.path.getmtime(file_path)),
+                                         keep_last_modified=keep_last_modified, **settings)
+        finally:
+            try:
+                mapped.close()
+            except BufferError:
+                # 仍有切片被引用时交由垃圾回收释放映射
+                pass
+
     async def _form_put(self, up_token, key, data, params, mime_type, crc, hostscache_dir=None, progress_handler=None,
                         file_name=None,
                         modify_time=None,
-                        keep_last_modified=False):
+                        keep_last_modified=False,
+                        throttle=None):
         fields = {}
         if params:
             for k, v in params.items():
@@ -265,7 +543,8 @@ class AsyncCow(_BaseCow):
         if modify_time and keep_last_modified:
             fields['x-qn-meta-!Last-Modified'] = rfc_from_timestamp(modify_time)
 
-        r, info = await self._http._post_file(url, data=fields, files={'file': (fname, data, mime_type)})
+        body = throttle.wrap(data) if throttle is not None else data
+        r, info = await self._http._post_file(url, data=fields, files={'file': (fname, body, mime_type)})
         if r is None and info.need_retry():
             if info.connect_failed:
                 if config.get_default('default_zone').up_host_backup:
@@ -278,7 +557,7 @@ class AsyncCow(_BaseCow):
                 data.seek(0)
             else:
                 return r, info
-            r, info = await self._http._post_file(url, data=fields, files={'file': (fname, data, mime_type)})
+            r, info = await self._http._post_file(url, data=fields, files={'file': (fname, body, mime_type)})
 
         return r, info
 
@@ -294,12 +573,132 @@ class AsyncCow(_BaseCow):
                          progress_handler=None,
                          upload_progress_recorder=None,
                          modify_time=None,
-                         keep_last_modified=False):
-
-        task = _Resume(up_token, key, input_stream, file_name, data_size, hostscache_dir, params, mime_type,
-                       progress_handler, upload_progress_recorder, modify_time, keep_last_modified, http=self.http)
+                         keep_last_modified=False,
+                         concurrency=1,
+                         version='v1',
+                         part_size=None,
+                         chunk_size=None,
+                         tenant=None,
+                         compress=None):
+
+        if compress:
+            # 压缩后长度未知，不记录断点，也不能使用v2
+            _check_compress_options(upload_progress_recorder=upload_progress_recorder,
+                                    keep_last_modified=keep_last_modified, version=version != 'v1',
+                                    part_size=part_size, chunk_size=chunk_size)
+            return await self.put_data(up_token, key, input_stream, params, mime_type,
+                                       progress_handler=progress_handler, fname=file_name,
+                                       hostscache_dir=hostscache_dir, concurrency=concurrency, tenant=tenant,
+                                       compress=compress)
+
+        throttle = self._get_token_throttle(up_token, tenant)
+        if version == 'v2':
+            task = _ResumeV2(up_token, key, input_stream, file_name, data_size, hostscache_dir, params, mime_type,
+                             progress_handler, upload_progress_recorder, modify_time, keep_last_modified,
+                             concurrency=concurrency, part_size=part_size, throttle=throttle, http=self.http)
+        else:
+            task = _Resume(up_token, key, input_stream, file_name, data_size, hostscache_dir, params, mime_type,
+                           progress_handler, upload_progress_recorder, modify_time, keep_last_modified,
+                           concurrency=concurrency, chunk_size=chunk_size, throttle=throttle, http=self.http)
         return await task.upload()
 
+    async def put_async_iter(self,
+                             up_token,
+                             key,
+                             aiter,
+                             params=None,
+                             mime_type=None,
+                             progress_handler=None,
+                             fname=None,
+                             hostscache_dir=None,
+                             concurrency=4,
+                             tenant=None):
+        """上传长度未知的异步可迭代对象到七牛
+
+        数据到达后即切分为块并发上传，全部完成后按实际长度mkfile，无需先落盘；不足一块（包括空数据）时表单上传。
+        该方式不记录断点，分块上传时 progress_handler 收到的总大小为None
+
+        Args:
+            up_token:         上传凭证
+            key:              上传文件名
+            aiter:            异步可迭代对象，每次产出任意长度的bytes，如异步生成器
+            params:           自定义变量，规格参考 http://developer.qiniu.com/docs/v6/api/overview/up/response/vars.html#xvar
+            mime_type:        上传数据的mimeType
+            progress_handler: 上传进度回调函数，可以是协程函数，也可以是普通函数或方法
+            fname:            文件名
+            hostscache_dir：  host请求 缓存文件保存位置
+            concurrency:      同时上传的块数
+            tenant:           租户标签，用于上传限速
+
+        Returns:
+            一个dict变量，类似 {"hash": "<Hash string>", "key": "<Key string>"}
+            一个ResponseInfo对象
+        """
+        reader = _async_reader(aiter)
+        head = await reader.read(config._BLOCK_SIZE)
+        if len(head) < config._BLOCK_SIZE:
+            # 数据已读完，mkfile不接受空文件，与put_data一致使用表单上传
+            head = bytes(head)
+            crc = await crc32_async(head, config.get_default('checksum_executor'),
+                                    config.get_default('checksum_inline_threshold'))
+            return await self._form_put(up_token, key, head, params, mime_type, crc, hostscache_dir, progress_handler,
+                                        fname, throttle=self._get_token_throttle(up_token, tenant))
+
+        return await self.put_stream(up_token, key, _iter_stream(reader, config._BLOCK_SIZE, [head]), fname, None,
+                                     hostscache_dir, params, mime_type, progress_handler, concurrency=concurrency,
+                                     tenant=tenant)
+
+    async def put_stream_reader(self,
+                                up_token,
+                                key,
+                                reader,
+                                data_size=None,
+                                params=None,
+                                mime_type='application/octet-stream',
+                                progress_handler=None,
+                                fname=None,
+                                hostscache_dir=None,
+                                concurrency=1,
+                                tenant=None):
+        """将aiohttp的请求体流转发上传到七牛
+
+        用于网关代理上传：直接从客户端连接中按块读取并上传，只有预读和上传中的块驻留内存，
+        未读取的数据留在socket中，由aiohttp对客户端形成背压。
+        已知长度且不超过8MB时读取后表单上传，其余情况分块上传
+
+        Args:
+            up_token:         上传凭证
+            key:              上传文件名
+            reader:           aiohttp.StreamReader，如 web.Request.content，也可以直接传入 web.Request
+            data_size:        请求体长度，传入web.Request时默认取其content_length
+            params:           自定义变量，规格参考 http://developer.qiniu.com/docs/v6/api/overview/up/response/vars.html#xvar
+            mime_type:        上传数据的mimeType
+            progress_handler: 上传进度回调函数，可以是协程函数，也可以是普通函数或方法
+            fname:            文件名
+            hostscache_dir：  host请求 缓存文件保存位置
+            concurrency:      分块上传时同时上传的块数
+            tenant:           租户标签，用于上传限速
+
+        Returns:
+            一个dict变量，类似 {"hash": "<Hash string>", "key": "<Key string>"}
+            一个ResponseInfo对象
+        """
+        if hasattr(reader, 'content') and hasattr(reader, 'content_length'):
+            if data_size is None:
+                data_size = reader.content_length
+            reader = reader.content
+
+        if data_size is not None and data_size <= config._BLOCK_SIZE * 2:
+            # 表单上传失败时需要重发，网络流无法回退，因此小文件先读入内存
+            data = await reader.read()
+            crc = await crc32_async(data, config.get_default('checksum_executor'),
+                                    config.get_default('checksum_inline_threshold'))
+            return await self._form_put(up_token, key, data, params, mime_type, crc, hostscache_dir,
+                                        progress_handler, fname, throttle=self._get_token_throttle(up_token, tenant))
+
+        return await self.put_stream(up_token, key, reader, fname, data_size, hostscache_dir, params, mime_type,
+                                     progress_handler, concurrency=concurrency, tenant=tenant)
+
 
 class ClientCow(_BaseCow):
 
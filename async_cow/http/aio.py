@@ -57,9 +57,9 @@ def _json_decoder(val, **kwargs):
 
 class Result(dict):
 
-    def __init__(self, status, headers, body, text, json_data):
+    def __init__(self, status, headers, body, text, json_data, url=None):
 
-        super().__init__(status=status, headers=headers, body=body, text=text, json=json_data)
+        super().__init__(status=status, headers=headers, body=body, text=text, json=json_data, url=url)
 
     def __bool__(self):
 
@@ -80,6 +80,11 @@ class Result(dict):
 
         return self.get(r'headers')
 
+    @property
+    def url(self):
+
+        return self.get(r'url')
+
     @property
     def body(self):
 
@@ -104,7 +109,8 @@ class CowHttpAuthBase(object):
 
 class CowClientRequest(ClientRequest):
 
-    def update_auth(self, auth: CowHttpAuthBase) -> None:
+    def update_auth(self, auth: CowHttpAuthBase, trust_env: bool = False) -> None:
+        # 新版本aiohttp会额外传入trust_env，这里不使用
 
         if auth is None:
             auth = self.auth
@@ -208,13 +214,15 @@ class _HTTPClient:
                             await self._handle_response(_response),
                             _text,
                             _json,
+                            str(_response.url),
                         )
 
             except aiohttp.ClientResponseError as err:
 
                 # 重新尝试的话，会记录异常，否则会继续抛出异常
+                # 七牛6xx、7xx为业务错误（如612文件不存在、701上下文失效），重试无意义
 
-                if err.status < 500:
+                if err.status < 500 or err.status >= 600:
                     raise err
                 elif times >= self._retry_count:
                     raise err
@@ -1,10 +1,11 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
 import platform
 import functools
 import traceback
 
-from aiohttp import FormData
+from aiohttp import ClientError, ClientResponseError, FormData
 from qiniu.http import ResponseInfo
 from async_cow.http.aio import CowClientRequest, logger, HTTPClientPool, CowHttpAuthBase, HTTPClient
 
@@ -12,6 +13,9 @@ _sys_info = '{0}; {1}'.format(platform.system(), platform.machine())
 
 USER_AGENT = 'QiniuPython/7.3.1 ({0}; ) Python/{1}'.format(_sys_info, platform.python_version())
 
+# 网络及HTTP错误，批量操作中转换为失败的ResponseInfo，其它异常视为程序错误直接抛出
+NETWORK_ERRORS = (ClientError, asyncio.TimeoutError, OSError)
+
 
 def return_wrapper(func):
 
@@ -23,7 +27,8 @@ def return_wrapper(func):
             logger.error(traceback.format_exc())
             return None, ResponseInfo(None, e)
         
-        if resp.status != 200 or resp.headers.get('X-Reqid') is None:
+        # 298为批量操作部分成功，响应体中包含每个操作的结果
+        if resp.status not in (200, 298) or resp.headers.get('X-Reqid') is None:
             return None, ResponseInfo(resp)
 
         resp.encoding = 'utf-8'
@@ -34,6 +39,40 @@ def return_wrapper(func):
     return _wrapper
 
 
+def response_status(info):
+    """返回响应的实际状态码
+
+    HTTP客户端对非2xx的响应抛出ClientResponseError，此时ResponseInfo的status_code为-1，实际状态码保存在异常中
+
+    Args:
+        info: ResponseInfo对象
+
+    Returns:
+        响应状态码，未收到响应（如连接失败）时为-1
+    """
+    if info.status_code == -1 and isinstance(info.exception, ClientResponseError):
+        return info.exception.status
+    return info.status_code
+
+
+def need_retry(info):
+    """请求失败后是否值得重试
+
+    与ResponseInfo.need_retry不同，按实际状态码判断：网络错误及5xx（579除外）时重试，4xx及6xx、7xx等业务错误不重试，
+    其它异常（程序错误）也不重试
+
+    Args:
+        info: ResponseInfo对象
+
+    Returns:
+        是否重试
+    """
+    status = response_status(info)
+    if status == -1:
+        return info.exception is None or isinstance(info.exception, NETWORK_ERRORS)
+    return (status // 100 == 5 and status != 579) or status == 996
+
+
 class SingletonMetaclass(type):
     """单例的元类
     """
@@ -149,6 +188,12 @@ class RequestBase(metaclass=SingletonMetaclass):
     def _post_with_token(self, url, data, token):
         return self._post(url, data, None, _TokenAuth(token))
 
+    def _post_with_token_and_headers(self, url, data, token, headers):
+        return self._post(url, data, None, _TokenAuth(token), headers)
+
+    def _put_with_token(self, url, data, token, headers=None):
+        return self._put(url, data, None, _TokenAuth(token), headers)
+
     def _post_file(self, url, data, files):
         return self._post(url, data, files, None)
 
@@ -158,6 +203,15 @@ class RequestBase(metaclass=SingletonMetaclass):
     def _get_with_auth(self, url, data, auth):
         return self._get(url, data, RequestsAuth(auth))
 
+    def _post_form_with_auth(self, url, body, auth):
+        # aiohttp在鉴权之后才生成请求体，urlencoded请求体需要参与签名，因此预先签名
+        token = auth.token_of_request(url, body, 'application/x-www-form-urlencoded')
+        headers = {
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'Authorization': 'QBox {0}'.format(token),
+        }
+        return self._post(url, body.encode('utf-8'), None, None, headers)
+
     def _post_with_auth_and_headers(self, url, data, auth, headers):
         return self._post(url, data, None, RequestsAuth(auth), headers)
 
@@ -47,10 +47,10 @@ class RtcServer(object):
             return self._get(self.host + '/v3/apps/%s/rooms' % app_id)
 
     def _post(self, url, data=None):
-        return self.cow._http._post_with_qiniu_mac(url, data, self.cow._auth)
+        return self.cow._http._post_with_qiniu_mac(url, data, self.cow.auth)
 
     def _get(self, url, params=None):
-        return self.cow._http._get_with_qiniu_mac(url, params, self.cow._auth)
+        return self.cow._http._get_with_qiniu_mac(url, params, self.cow.auth)
 
     def _delete(self, url, params=None):
-        return self.cow._http._delete_with_qiniu_mac(url, params, self.cow._auth)
+        return self.cow._http._delete_with_qiniu_mac(url, params, self.cow.auth)
@@ -53,4 +53,4 @@ class PersistentFop(object):
             data['force'] = 1
 
         url = '{0}/pfop'.format(config.get_default('default_api_host'))
-        return self.cow.http._post_with_auth(url, data, self.cow.auth)
+        return self.cow.http._post_with_auth(url, data, self.cow.get_auth(self.bucket))
@@ -1,9 +1,18 @@
 # -*- coding: utf-8 -*-
 
+from urllib.parse import urlencode
+
 from async_cow import config
+from async_cow.service.storage.bulk import PutMany, _identical_result
+from async_cow.service.storage.content import put_content_addressed
+from async_cow.service.storage.listing import KeyIterator, ShardedKeyIterator, LIST_RATE_LIMIT
+from async_cow.service.storage.sync import sync_dir
 from async_cow.utils import urlsafe_base64_encode, entry
 
 
+BATCH_MAX_OPS = 1000  # 单次batch请求的最大操作数
+
+
 class Bucket(object):
     """空间管理类
 
@@ -30,14 +39,17 @@ class Bucket(object):
                        check_crc=False,
                        progress_handler=None,
                        fname=None,
-                       hostscache_dir=None):
+                       hostscache_dir=None,
+                       concurrency=1,
+                       tenant=None,
+                       compress=None):
 
         token = self._cow.get_token(
             self._bucket, key
         )
 
         return await self._cow.put_data(token, key, data, params, mime_type, check_crc, progress_handler, fname,
-                                        hostscache_dir)
+                                        hostscache_dir, concurrency=concurrency, tenant=tenant, compress=compress)
 
     async def put_file(self,
                        key,
@@ -48,14 +60,30 @@ class Bucket(object):
                        progress_handler=None,
                        upload_progress_recorder=None,
                        keep_last_modified=False,
-                       hostscache_dir=None):
+                       hostscache_dir=None,
+                       concurrency=1,
+                       version='v1',
+                       part_size=None,
+                       chunk_size=None,
+                       use_mmap=False,
+                       tenant=None,
+                       skip_identical=False,
+                       compress=None):
+        # skip_identical为True时先stat远端文件，大小和hash与本地etag一致则不上传，返回结果中skipped为True
+        if skip_identical:
+            stat, info = await self.stat(key)
+            ret = await _identical_result(key, stat, file_path, part_size if version == 'v2' else None)
+            if ret is not None:
+                return ret, info
 
         token = self._cow.get_token(
             self._bucket, key
         )
 
         return await self._cow.put_file(token, key, file_path, params, mime_type, check_crc, progress_handler,
-                                        upload_progress_recorder, keep_last_modified, hostscache_dir)
+                                        upload_progress_recorder, keep_last_modified, hostscache_dir,
+                                        concurrency=concurrency, version=version, part_size=part_size,
+                                        chunk_size=chunk_size, use_mmap=use_mmap, tenant=tenant, compress=compress)
 
     async def put_stream(self,
                          key,
@@ -68,14 +96,129 @@ class Bucket(object):
                          progress_handler=None,
                          upload_progress_recorder=None,
                          modify_time=None,
-                         keep_last_modified=False):
+                         keep_last_modified=False,
+                         concurrency=1,
+                         version='v1',
+                         part_size=None,
+                         chunk_size=None,
+                         tenant=None,
+                         compress=None):
 
         token = self._cow.get_token(
             self._bucket, key
         )
         return await self._cow.put_stream(token, key, input_stream, file_name, data_size, hostscache_dir, params,
                                           mime_type, progress_handler, upload_progress_recorder, modify_time,
-                                          keep_last_modified)
+                                          keep_last_modified, concurrency=concurrency, version=version,
+                                          part_size=part_size, chunk_size=chunk_size, tenant=tenant,
+                                          compress=compress)
+
+    async def put_async_iter(self,
+                             key,
+                             aiter,
+                             params=None,
+                             mime_type=None,
+                             progress_handler=None,
+                             fname=None,
+                             hostscache_dir=None,
+                             concurrency=4,
+                             tenant=None):
+
+        token = self._cow.get_token(
+            self._bucket, key
+        )
+        return await self._cow.put_async_iter(token, key, aiter, params, mime_type, progress_handler, fname,
+                                              hostscache_dir, concurrency=concurrency, tenant=tenant)
+
+    async def put_stream_reader(self,
+                                key,
+                                reader,
+                                data_size=None,
+                                params=None,
+                                mime_type='application/octet-stream',
+                                progress_handler=None,
+                                fname=None,
+                                hostscache_dir=None,
+                                concurrency=1,
+                                tenant=None):
+
+        token = self._cow.get_token(
+            self._bucket, key
+        )
+        return await self._cow.put_stream_reader(token, key, reader, data_size, params, mime_type, progress_handler,
+                                                 fname, hostscache_dir, concurrency=concurrency, tenant=tenant)
+
+    def put_many(self, items, workers=16, retries=2, retry_delay=1, **options):
+        """批量上传文件:
+
+        适用于数十万以上的小文件，同时上传的文件数和排队的文件数均有上限，结果按完成顺序返回
+
+        Args:
+            items:          (key, file_path) 的可迭代对象或异步可迭代对象，按需读取
+            workers:        同时上传的文件数
+            retries:        单个文件失败后的最大重试次数
+            retry_delay:    首次重试前等待的秒数，之后每次翻倍
+            options:        传给put_file的其它参数，如 params、mime_type、tenant；
+                            skip_identical为True时每1000个文件一次batch stat，与本地etag一致的文件不上传，
+                            同时计算etag的文件数由hash_workers指定，默认为4
+
+        Returns:
+            一个PutMany对象，异步迭代得到 (key, file_path, ret, info)，stats 属性为吞吐量统计
+
+        Usage:
+            uploads = bucket.put_many(items)
+            async for key, file_path, ret, info in uploads:
+                ...
+            print(uploads.stats)
+        """
+        return PutMany(self, items, workers, retries, retry_delay, **options)
+
+    async def sync_dir(self, local_dir, prefix='', delete=False, etag_cache=None, workers=16, hash_workers=4,
+                       **options):
+        """增量同步本地目录:
+
+        列举远端前缀下的文件，与本地文件的etag比较，只上传新增或修改过的文件。
+        本地etag缓存以 (路径, inode, 大小, 修改时间) 判断文件是否变化，未变化的文件不再重新计算
+
+        Args:
+            local_dir:      本地目录
+            prefix:         远端前缀，文件名为 prefix + 相对路径
+            delete:         是否删除远端存在而本地不存在的文件
+            etag_cache:     EtagCache对象，默认使用系统临时目录中的缓存
+            workers:        同时上传或删除的文件数
+            hash_workers:   同时计算etag的文件数
+            options:        传给put_file的其它参数
+
+        Returns:
+            一个dict变量，类似 {"uploaded": 10, "skipped": 990, "deleted": 0, "failed": [(key, info)], "stats": {...}}
+
+        Raises:
+            IOError: 列举远端文件失败
+        """
+        return await sync_dir(self, local_dir, prefix, delete, etag_cache, workers, hash_workers, **options)
+
+    @property
+    def existence_cache(self):
+        """空间的已存在文件缓存，见 AsyncCow.set_existence_cache"""
+        return self._cow.get_existence_cache(self._bucket)
+
+    async def put_content_addressed(self, file_path, prefix='', existence_cache=None, **options):
+        """按内容寻址上传文件:
+
+        文件名为 prefix + 文件的etag，内容相同的文件只保存一份。
+        缓存确认已存在的文件不发起任何网络请求；布隆过滤器判断不存在时直接上传，其余情况先stat确认
+
+        Args:
+            file_path:          上传文件的路径
+            prefix:             文件名前缀
+            existence_cache:    ExistenceCache对象，默认使用 existence_cache 属性
+            options:            传给put_file的其它参数
+
+        Returns:
+            一个dict变量，类似 {"hash": "<Hash string>", "key": "<Key string>"}，文件已存在时skipped为True
+            一个ResponseInfo对象，命中缓存未发起请求时状态码为200，req_id为None
+        """
+        return await put_content_addressed(self, file_path, prefix, existence_cache, **options)
 
     async def list(self, prefix=None, marker=None, limit=None, delimiter=None):
         """前缀查询:
@@ -118,6 +261,46 @@ class Bucket(object):
 
         return ret, eof, info
 
+    def iter_keys(self, prefix=None, delimiter=None, page_size=1000, marker=None):
+        """遍历前缀下的所有文件:
+
+        异步迭代逐个返回文件信息，使用当前页的同时预取下一页
+
+        Args:
+            prefix:     列举前缀
+            delimiter:  指定目录分隔符，公共前缀保存在返回对象的 common_prefixes 中
+            page_size:  每页文件数，最大1000
+            marker:     从该标识符恢复列举，通常为上次保存的 marker 属性
+
+        Returns:
+            一个KeyIterator对象，异步迭代得到类似 {"hash": "<Hash string>", "key": "<Key string>"} 的dict，
+            marker 属性为断点续列的标识符，列举失败时迭代抛出IOError
+        """
+        return KeyIterator(self, prefix, delimiter, page_size, marker)
+
+    def iter_keys_sharded(self, prefix='', prefixes=None, delimiter='/', workers=8, ordered=False, page_size=1000,
+                          rate_limit=LIST_RATE_LIMIT, retries=3):
+        """按前缀分片并行遍历文件:
+
+        适用于文件数很多的空间。未指定prefixes时以delimiter列举prefix的第一层，公共前缀作为分片；
+        同时列举workers个分片，所有列举请求共用rate_limit的令牌桶
+
+        Args:
+            prefix:     列举前缀，自动分片时使用
+            prefixes:   指定分片前缀，互相之间不能存在前缀关系，指定后不再自动分片
+            delimiter:  自动分片时的目录分隔符
+            workers:    同时列举的分片数
+            ordered:    是否按文件名顺序返回，为False时按到达顺序返回
+            page_size:  每页文件数，最大1000
+            rate_limit: 每秒列举请求数上限，为None时不限制
+            retries:    单页请求因网络错误、5xx或频率超限失败时的最大重试次数，其它错误不重试
+
+        Returns:
+            一个ShardedKeyIterator对象，异步迭代得到类似 {"hash": "<Hash string>", "key": "<Key string>"} 的dict，
+            列举失败时迭代抛出IOError
+        """
+        return ShardedKeyIterator(self, prefix, prefixes, delimiter, workers, ordered, page_size, rate_limit, retries)
+
     async def stat(self, key):
         """获取文件信息:
 
@@ -338,7 +521,29 @@ class Bucket(object):
             一个ResponseInfo对象
         """
         url = '{0}/batch'.format(config.get_default('default_rs_host'))
-        return await self._post(url, dict(op=operations))
+        body = urlencode([('op', op) for op in operations])
+        return await self._cow.http._post_form_with_auth(url, body, self._cow.get_auth(self._bucket))
+
+    async def stat_many(self, keys):
+        """批量获取文件信息:
+
+        按每次最多1000个文件拆分为多个batch stat请求
+
+        Args:
+            keys:   待获取信息的文件名列表
+
+        Returns:
+            一个list变量，与keys一一对应，文件存在时为stat的结果，不存在时为None；请求失败时返回None
+            一个ResponseInfo对象
+        """
+        results = []
+        info = None
+        for start in range(0, len(keys), BATCH_MAX_OPS):
+            ret, info = await self.batch(self.build_batch_stat(self._bucket, keys[start:start + BATCH_MAX_OPS]))
+            if ret is None:
+                return None, info
+            results.extend(item.get('data') if item.get('code') == 200 else None for item in ret)
+        return results, info
 
     async def buckets(self):
         """获取所有空间名:
@@ -438,7 +643,7 @@ class Bucket(object):
         return await self._server_do(config.get_default('default_rs_host'), operation, *args)
 
     async def _io_do(self, bucket, operation, home_dir, *args):
-        ak = self._cow.get_access_key()
+        ak = self._cow.get_access_key(self._bucket)
         io_host = await self.zone.get_io_host(ak, bucket, home_dir)
         return await self._server_do(io_host, operation, *args)
 
@@ -448,10 +653,10 @@ class Bucket(object):
         return await self._post(url)
 
     async def _post(self, url, data=None):
-        return await self._cow.http._post_with_auth(url, data, self._cow.auth)
+        return await self._cow.http._post_with_auth(url, data, self._cow.get_auth(self._bucket))
 
     async def _get(self, url, params=None):
-        return await self._cow.http._get_with_auth(url, params, self._cow.auth)
+        return await self._cow.http._get_with_auth(url, params, self._cow.get_auth(self._bucket))
 
     @classmethod
     def _build_op(cls, *args):
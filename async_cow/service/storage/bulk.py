@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import time
+
+from qiniu.http import ResponseInfo
+
+from async_cow import config
+from async_cow.http.aio import logger
+from async_cow.http.base import need_retry, NETWORK_ERRORS
+from async_cow.utils import etag_async, etag_v2_async
+
+
+_DONE = object()
+
+STAT_BATCH_SIZE = 1000  # skip_identical时每次batch stat的文件数
+
+
+async def _identical_result(key, stat, file_path, part_size=None):
+    """远端文件与本地文件相同时返回跳过上传的结果，否则返回None
+
+    先比较大小，大小一致时才计算本地etag；v2上传的文件同时比较分片上传v2的etag
+    """
+    if not stat:
+        return None
+    try:
+        size = os.stat(file_path).st_size
+    except OSError:
+        return None
+    if stat.get('fsize') != size:
+        return None
+
+    remote_hash = stat.get('hash')
+    executor = config.get_default('checksum_executor')
+    if remote_hash != await etag_async(file_path, executor):
+        if not isinstance(part_size, int) or remote_hash != await etag_v2_async(file_path, part_size, executor):
+            return None
+    return {'key': key, 'hash': remote_hash, 'fsize': size, 'skipped': True}
+
+
+class PutMany(object):
+    """批量上传文件
+
+    生产者按需读取 (key, file_path) 序列放入有界队列，workers 个消费者并发上传，内存占用与文件总数无关。
+    每个文件按大小自动选择表单上传或分块上传，网络错误及5xx按指数退避重试，其它异常直接抛出。
+    skip_identical为True时每 STAT_BATCH_SIZE 个文件一次batch stat，远端大小和hash与本地etag一致的文件不上传，
+    同时计算etag的文件数不超过 hash_workers。
+    结果以异步迭代器的形式按完成顺序返回，每项为 (key, file_path, ret, info)，跳过的文件ret中skipped为True
+
+    Attributes:
+        workers:        同时上传的文件数
+        retries:        单个文件失败后的最大重试次数
+        retry_delay:    首次重试前等待的秒数，之后每次翻倍
+        skip_identical: 是否跳过与远端相同的文件
+        hash_workers:   skip_identical时同时计算etag的文件数
+    """
+
+    def __init__(self, bucket, items, workers=16, retries=2, retry_delay=1, skip_identical=False, hash_workers=4,
+                 **options):
+        self.workers = max(1, workers)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.skip_identical = skip_identical
+        self.hash_workers = max(1, hash_workers)
+
+        self._bucket = bucket
+        self._items = items
+        self._options = options
+
+        self._queue = asyncio.Queue(self.workers * 2)
+        self._results = asyncio.Queue(self.workers * 2)
+        self._hash_semaphore = asyncio.Semaphore(self.hash_workers)
+        self._task = None
+
+        self._started_at = None
+        self._finished_at = None
+        self._files = 0
+        self._failed = 0
+        self._skipped = 0
+        self._bytes = 0
+
+    def __aiter__(self):
+        if self._task is None:
+            self._started_at = time.monotonic()
+            self._task = asyncio.ensure_future(self._run())
+        return self
+
+    async def __anext__(self):
+        result = await self._results.get()
+        if result is _DONE:
+            raise StopAsyncIteration
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+    @property
+    def stats(self):
+        """当前的统计信息，包含已完成文件数、失败数、上传字节数、耗时以及每秒的字节数和文件数"""
+        if self._started_at is None:
+            elapsed = 0
+        else:
+            elapsed = (self._finished_at or time.monotonic()) - self._started_at
+        return {
+            'files': self._files,
+            'failed': self._failed,
+            'skipped': self._skipped,
+            'bytes': self._bytes,
+            'elapsed': elapsed,
+            'bytes_per_second': self._bytes / elapsed if elapsed else 0,
+            'files_per_second': self._files / elapsed if elapsed else 0,
+        }
+
+    async def close(self):
+        """停止上传，未开始的文件不再上传"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        workers = [asyncio.ensure_future(self._consume()) for _ in range(self.workers)]
+        try:
+            await self._produce()
+            for _ in workers:
+                await self._queue.put(_DONE)
+            await asyncio.gather(*workers)
+        except Exception as e:
+            await self._results.put(e)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            self._finished_at = time.monotonic()
+
+        logger.info(f'put_many finished => {self.stats}')
+        await self._results.put(_DONE)
+
+    async def _iter_items(self):
+        if hasattr(self._items, '__aiter__'):
+            async for item in self._items:
+                yield item
+        else:
+            for item in self._items:
+                yield item
+
+    async def _produce(self):
+        batch = []
+        async for item in self._iter_items():
+            if not self.skip_identical:
+                await self._queue.put(item)
+                continue
+            batch.append(item)
+            if len(batch) >= STAT_BATCH_SIZE:
+                await self._enqueue_changed(batch)
+                batch = []
+        if batch:
+            await self._enqueue_changed(batch)
+
+    async def _enqueue_changed(self, batch):
+        stats, info = await self._bucket.stat_many([key for key, _ in batch])
+        if stats is None:
+            # batch stat失败时全部上传
+            stats = [None] * len(batch)
+
+        part_size = self._options.get('part_size') if self._options.get('version') == 'v2' else None
+
+        async def compare(key, stat, file_path):
+            async with self._hash_semaphore:
+                return await _identical_result(key, stat, file_path, part_size)
+
+        identical = await asyncio.gather(*[
+            compare(key, stat, file_path) for (key, file_path), stat in zip(batch, stats)
+        ])
+
+        for (key, file_path), ret in zip(batch, identical):
+            if ret is None:
+                await self._queue.put((key, file_path))
+            else:
+                self._files += 1
+                self._skipped += 1
+                await self._results.put((key, file_path, ret, info))
+
+    async def _consume(self):
+        while True:
+            item = await self._queue.get()
+            if item is _DONE:
+                return
+            key, file_path = item
+            ret, info = await self._put(key, file_path)
+            await self._results.put((key, file_path, ret, info))
+
+    async def _put(self, key, file_path):
+        try:
+            size = os.stat(file_path).st_size
+        except OSError as e:
+            self._files += 1
+            self._failed += 1
+            return None, ResponseInfo(None, e)
+
+        delay = self.retry_delay
+        for attempt in range(self.retries + 1):
+            try:
+                ret, info = await self._bucket.put_file(key, file_path, **self._options)
+            except NETWORK_ERRORS as e:
+                ret, info = None, ResponseInfo(None, e)
+            if ret is not None or not need_retry(info) or attempt == self.retries:
+                break
+            logger.warning(f'put_many {key} => retry:{attempt + 1}')
+            await asyncio.sleep(delay)
+            delay *= 2
+
+        self._files += 1
+        if ret is None:
+            self._failed += 1
+        else:
+            self._bytes += size
+        return ret, info
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+import math
+import os
+import struct
+import tempfile
+
+from hashlib import sha1
+
+from cachetools import LRUCache
+from qiniu.http import ResponseInfo
+
+from async_cow import config
+from async_cow.http.aio import Result
+from async_cow.utils import etag_async
+
+
+_BLOOM_MAGIC = b'ACBF'
+_BLOOM_HEADER = struct.Struct('<4sQI')  # magic, 位数, 哈希函数个数
+
+
+class BloomFilter(object):
+    """布隆过滤器
+
+    判断不存在时一定不存在，判断存在时有 error_rate 的概率误判。指定 path 时从文件加载，并可通过 save 写回
+
+    Attributes:
+        path:       持久化文件路径，为None时只保存在内存中
+        capacity:   预计的元素个数
+        error_rate: 元素个数达到capacity时的误判率
+    """
+
+    def __init__(self, path=None, capacity=1000000, error_rate=0.01):
+        self.path = path
+        self.capacity = capacity
+        self.error_rate = error_rate
+
+        self._bits = None
+        if path is not None and os.path.exists(path):
+            self._load()
+        if self._bits is None:
+            self._size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+            self._hashes = max(1, int(round(self._size / capacity * math.log(2))))
+            self._bits = bytearray((self._size + 7) // 8)
+
+    def _positions(self, item):
+        digest = sha1(item.encode('utf-8')).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:16], 'little') | 1
+        return [(h1 + i * h2) % self._size for i in range(self._hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def _load(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        if len(data) < _BLOOM_HEADER.size:
+            return
+        magic, size, hashes = _BLOOM_HEADER.unpack_from(data)
+        bits = data[_BLOOM_HEADER.size:]
+        if magic != _BLOOM_MAGIC or len(bits) != (size + 7) // 8:
+            # 文件损坏时重新开始
+            return
+        self._size = size
+        self._hashes = hashes
+        self._bits = bytearray(bits)
+
+    def save(self):
+        """写回持久化文件，先写临时文件再替换，避免写入中断导致文件损坏"""
+        if self.path is None:
+            return
+        folder = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=folder)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_BLOOM_HEADER.pack(_BLOOM_MAGIC, self._size, self._hashes))
+                f.write(self._bits)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+
+class ExistenceCache(object):
+    """空间中已存在文件的缓存
+
+    进程内的有界LRU记录最近确认存在的文件名，命中时无需任何网络请求；
+    可选的布隆过滤器记录所有上传或确认过的文件名，判断不存在时直接上传，判断存在时再通过stat确认。
+    布隆过滤器创建时从文件加载，通过 AsyncCow.set_existence_cache 设置的缓存在 AsyncCow.release 时自动写回
+
+    Attributes:
+        maxsize:    LRU缓存的最大文件名个数
+        bloom:      BloomFilter对象，为None时LRU未命中的文件都需要stat确认
+    """
+
+    def __init__(self, maxsize=100000, bloom=None):
+        self.maxsize = maxsize
+        self.bloom = bloom
+        self._lru = LRUCache(maxsize)
+
+    def known(self, key):
+        """文件是否确认存在"""
+        return self._lru.get(key, False)
+
+    def maybe(self, key):
+        """文件是否可能存在，为False时一定不存在"""
+        return self.bloom is None or key in self.bloom
+
+    def add(self, key):
+        self._lru[key] = True
+        if self.bloom is not None:
+            self.bloom.add(key)
+
+    def save(self):
+        """写回布隆过滤器"""
+        if self.bloom is not None:
+            self.bloom.save()
+
+
+def _cached_info(result):
+    # 命中缓存时没有实际请求，返回状态码为200、req_id为None的ResponseInfo
+    info = ResponseInfo(Result(200, {}, b'', '', result))
+    info.error = None
+    return info
+
+
+async def put_content_addressed(bucket, file_path, prefix='', existence_cache=None, **options):
+    """以内容etag为文件名上传文件，用法见 Bucket.put_content_addressed"""
+    file_hash = await etag_async(file_path, config.get_default('checksum_executor'))
+    key = prefix + file_hash
+    result = {'key': key, 'hash': file_hash, 'skipped': True}
+
+    cache = existence_cache
+    if cache is None:
+        cache = bucket.existence_cache
+    if cache.known(key):
+        return result, _cached_info(result)
+
+    if cache.maybe(key):
+        ret, info = await bucket.stat(key)
+        if ret is not None:
+            cache.add(key)
+            return result, info
+
+    ret, info = await bucket.put_file(key, file_path, **options)
+    if ret is not None:
+        cache.add(key)
+    return ret, info
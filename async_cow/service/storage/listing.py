@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+from collections import deque
+
+from async_cow.http.aio import logger
+from async_cow.http.base import response_status, need_retry
+from async_cow.service.storage.throttle import TokenBucket, Throttle
+
+
+LIST_RATE_LIMIT = 100  # 并行列举时每秒列举请求数的默认上限
+RETRY_DELAY = 1  # 首次重试前等待的秒数，之后按指数退避
+
+_DONE = object()
+
+
+class KeyIterator(object):
+    """逐个返回文件信息的列举迭代器
+
+    使用当前页的同时在后台请求下一页，页与页之间无需等待一次完整的往返。
+    marker 属性可用于断点续列：当前页的最后一个文件返回后更新为下一页的标识符，
+    从保存的 marker 重新列举不会遗漏文件，最多重复一页
+
+    Attributes:
+        prefix:             列举前缀
+        delimiter:          目录分隔符
+        page_size:          每页文件数
+        marker:             恢复列举时使用的标识符，列举结束时为None
+        common_prefixes:    指定delimiter时已列举到的公共前缀
+        throttle:           Throttle对象，每次列举请求消耗一个令牌
+        retries:            单页请求因网络错误、5xx或频率超限（573）失败时的最大重试次数，按指数退避，
+                            其它错误（如401、612、631）直接抛出
+    """
+
+    def __init__(self, bucket, prefix=None, delimiter=None, page_size=1000, marker=None, throttle=None, retries=0):
+        self.prefix = prefix
+        self.delimiter = delimiter
+        self.page_size = page_size
+        self.marker = marker
+        self.common_prefixes = []
+        self.throttle = throttle
+        self.retries = retries
+
+        self._bucket = bucket
+        self._items = deque()
+        self._next_marker = marker
+        self._next_page = None
+        self._eof = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._items:
+            if self._eof:
+                self.marker = None
+                raise StopAsyncIteration
+            await self._load()
+
+        item = self._items.popleft()
+        if not self._items:
+            self.marker = self._next_marker
+        return item
+
+    async def _fetch(self, marker):
+        delay = RETRY_DELAY
+        for attempt in range(self.retries + 1):
+            if self.throttle is not None:
+                await self.throttle.consume(1)
+            ret, eof, info = await self._bucket.list(self.prefix, marker, self.page_size, self.delimiter)
+            if ret is not None:
+                return ret, eof
+            if attempt == self.retries or not need_retry(info):
+                break
+            logger.warning(f'list {self.prefix} => retry:{attempt + 1} status:{response_status(info)}')
+            await asyncio.sleep(delay)
+            delay *= 2
+        raise IOError('list {0} failed: {1}'.format(self.prefix, info.error))
+
+    async def _load(self):
+        page, self._next_page = self._next_page, None
+        if page is None:
+            page = asyncio.ensure_future(self._fetch(self._next_marker))
+        ret, eof = await page
+
+        self._next_marker = ret.get('marker')
+        self._eof = eof or not self._next_marker
+        if not self._eof:
+            # 预取下一页
+            self._next_page = asyncio.ensure_future(self._fetch(self._next_marker))
+
+        for common in ret.get('commonPrefixes', []):
+            # 跨页的公共前缀会在相邻两页中重复返回
+            if not self.common_prefixes or self.common_prefixes[-1] != common:
+                self.common_prefixes.append(common)
+        self._items.extend(ret.get('items', []))
+        if not self._items:
+            self.marker = self._next_marker
+
+    async def close(self):
+        """停止列举，取消预取中的请求"""
+        if self._next_page is not None and not self._next_page.done():
+            self._next_page.cancel()
+            try:
+                await self._next_page
+            except asyncio.CancelledError:
+                pass
+        self._next_page = None
+
+
+class ShardedKeyIterator(object):
+    """按前缀分片并行列举的迭代器
+
+    将空间按前缀拆分为多个分片，同时列举 workers 个分片，每个分片是一条独立的marker链并预取下一页。
+    未指定 prefixes 时先以 delimiter 列举 prefix 的第一层，得到的公共前缀作为分片，第一层的文件直接返回。
+    所有列举请求共用一个令牌桶，避免超出列举接口的频率限制
+
+    Attributes:
+        prefix:     列举前缀，自动分片时使用
+        prefixes:   指定的分片前缀，互相之间不能存在前缀关系
+        delimiter:  自动分片时的目录分隔符
+        workers:    同时列举的分片数
+        ordered:    为True时按文件名顺序返回，否则按到达顺序返回
+        shards:     实际使用的分片前缀
+    """
+
+    def __init__(self, bucket, prefix='', prefixes=None, delimiter='/', workers=8, ordered=False, page_size=1000,
+                 rate_limit=LIST_RATE_LIMIT, retries=3):
+        self.prefix = prefix or ''
+        self.prefixes = prefixes
+        self.delimiter = delimiter
+        self.workers = max(1, workers)
+        self.ordered = ordered
+        self.page_size = page_size
+        self.retries = retries
+        self.throttle = Throttle(TokenBucket(rate_limit))
+        self.shards = []
+
+        self._bucket = bucket
+        self._results = asyncio.Queue(page_size * 2)
+        self._task = None
+
+    def __aiter__(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        return self
+
+    async def __anext__(self):
+        result = await self._results.get()
+        if result is _DONE:
+            raise StopAsyncIteration
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+    async def close(self):
+        """停止列举"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def _iter(self, prefix, delimiter=None):
+        return KeyIterator(self._bucket, prefix or None, delimiter, self.page_size,
+                           throttle=self.throttle, retries=self.retries)
+
+    async def _run(self):
+        try:
+            if self.ordered:
+                await self._run_ordered()
+            else:
+                await self._run_unordered()
+        except Exception as e:
+            await self._results.put(e)
+        await self._results.put(_DONE)
+
+    async def _discover(self, on_item):
+        # 列举第一层，文件交给on_item，公共前缀作为分片
+        if self.prefixes is not None:
+            self.shards = sorted(set(self.prefixes))
+            return
+        keys = self._iter(self.prefix, self.delimiter)
+        async for item in keys:
+            await on_item(item)
+        self.shards = sorted(set(keys.common_prefixes))
+        logger.info(f'list {self.prefix} => {len(self.shards)} shards')
+
+    async def _run_unordered(self):
+        await self._discover(self._results.put)
+
+        shards = asyncio.Queue()
+        for shard in self.shards:
+            shards.put_nowait(shard)
+
+        async def consume():
+            while not shards.empty():
+                async for item in self._iter(shards.get_nowait()):
+                    await self._results.put(item)
+
+        workers = [asyncio.ensure_future(consume()) for _ in range(self.workers)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+    async def _run_ordered(self):
+        root = deque()
+
+        async def keep(item):
+            root.append(item)
+
+        await self._discover(keep)
+
+        # 分片是互不重叠且有序的区间，按顺序拼接即有序，第一层的文件按文件名插入
+        semaphore = asyncio.Semaphore(self.workers)
+        queues = [asyncio.Queue(self.page_size * 2) for _ in self.shards]
+
+        async def produce(shard, queue):
+            # 分片列举失败时将异常放入队列，由消费方抛出
+            try:
+                async with semaphore:
+                    async for item in self._iter(shard):
+                        await queue.put(item)
+            except Exception as e:
+                await queue.put(e)
+            await queue.put(_DONE)
+
+        tasks = [asyncio.ensure_future(produce(shard, queue)) for shard, queue in zip(self.shards, queues)]
+        try:
+            for queue in queues:
+                while True:
+                    item = await queue.get()
+                    if item is _DONE:
+                        break
+                    if isinstance(item, BaseException):
+                        raise item
+                    while root and root[0]['key'] < item['key']:
+                        await self._results.put(root.popleft())
+                    await self._results.put(item)
+            while root:
+                await self._results.put(root.popleft())
+        finally:
+            for task in tasks:
+                task.cancel()
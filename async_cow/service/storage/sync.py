@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import sqlite3
+import tempfile
+
+from concurrent.futures import ThreadPoolExecutor
+
+from qiniu.http import ResponseInfo
+
+from async_cow import config
+from async_cow.http.aio import logger
+from async_cow.utils import etag_async
+
+
+class EtagCache(object):
+    """本地文件etag缓存
+
+    以文件路径为主键保存etag，同时记录 inode、大小和修改时间(纳秒)，三者任一变化即视为文件已修改，需要重新计算。
+    数据保存在SQLite数据库中，只在专用的单线程执行器中访问
+
+    Attributes:
+        db_path:    数据库文件路径，默认位于系统临时目录
+    """
+
+    def __init__(self, db_path=None):
+        if db_path is None:
+            db_path = os.path.join(tempfile.gettempdir(), 'async_cow_etag_cache.db')
+
+        self.db_path = db_path
+
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    async def _run(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(self._executor, func, *args)
+
+    async def get_many(self, files):
+        """批量查询etag
+
+        Args:
+            files:  (path, stat_result) 的列表
+
+        Returns:
+            一个dict变量，path -> etag，只包含缓存有效的文件
+        """
+        return await self._run(self._get_many, files)
+
+    async def set_many(self, entries):
+        """批量写入etag
+
+        Args:
+            entries:    (path, stat_result, etag) 的列表
+        """
+        await self._run(self._set_many, entries)
+
+    async def close(self):
+        await self._run(self._close)
+        self._executor.shutdown(wait=False)
+
+    def _connect(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            with conn:
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS etag_cache ('
+                    'path TEXT PRIMARY KEY, inode INTEGER NOT NULL, size INTEGER NOT NULL, '
+                    'mtime_ns INTEGER NOT NULL, etag TEXT NOT NULL)'
+                )
+            self._conn = conn
+        return self._conn
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _get_many(self, files):
+        conn = self._connect()
+        etags = {}
+        for path, st in files:
+            row = conn.execute(
+                'SELECT inode, size, mtime_ns, etag FROM etag_cache WHERE path = ?', (path,)
+            ).fetchone()
+            if row is not None and row[:3] == (st.st_ino, st.st_size, st.st_mtime_ns):
+                etags[path] = row[3]
+        return etags
+
+    def _set_many(self, entries):
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO etag_cache (path, inode, size, mtime_ns, etag) VALUES (?, ?, ?, ?, ?)',
+                [(path, st.st_ino, st.st_size, st.st_mtime_ns, value) for path, st, value in entries]
+            )
+
+
+def _scan_dir(local_dir, prefix):
+    files = []
+    for dir_path, _, names in os.walk(local_dir):
+        for name in names:
+            path = os.path.abspath(os.path.join(dir_path, name))
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if not os.path.isfile(path):
+                continue
+            key = prefix + os.path.relpath(path, local_dir).replace(os.sep, '/')
+            files.append((key, path, st))
+    return files
+
+
+_DONE = object()
+
+ETAG_BATCH_SIZE = 1000  # 每次批量查询或写入etag缓存的文件数
+
+
+def _start_workers(queue, count, handle):
+    """启动count个消费者，逐个处理队列中的任务，收到_DONE时退出"""
+    async def work():
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                return
+            await handle(item)
+
+    return [asyncio.ensure_future(work()) for _ in range(count)]
+
+
+async def _stop_workers(queue, workers):
+    for _ in workers:
+        await queue.put(_DONE)
+    await asyncio.gather(*workers)
+
+
+async def sync_dir(bucket, local_dir, prefix='', delete=False, etag_cache=None, workers=16, hash_workers=4,
+                   **options):
+    """将本地目录增量同步到空间，用法见 Bucket.sync_dir
+
+    远端文件边列举边比较，不在内存中保存完整的列举结果；计算etag、上传和删除分别由固定个数的消费者从有界队列中取任务
+    """
+    local_dir = os.path.abspath(local_dir)
+    loop = asyncio.get_event_loop()
+
+    files = await loop.run_in_executor(None, _scan_dir, local_dir, prefix)
+    # 列举结束后剩下的是远端不存在的新文件
+    local = {key: (path, st) for key, path, st in files}
+
+    result = {
+        'uploaded': 0,
+        'skipped': 0,
+        'deleted': 0,
+        'failed': [],
+    }
+
+    cache = etag_cache if etag_cache is not None else EtagCache()
+    computed = []
+
+    async def flush_computed(force=False):
+        if computed and (force or len(computed) >= ETAG_BATCH_SIZE):
+            entries = computed[:]
+            del computed[:]
+            await cache.set_many(entries)
+
+    upload_queue = asyncio.Queue(workers * 2)
+
+    async def changed_items():
+        while True:
+            item = await upload_queue.get()
+            if item is _DONE:
+                return
+            yield item
+
+    async def compare(item):
+        key, path, st, remote_hash, etag = item
+        if etag is None:
+            try:
+                etag = await etag_async(path, config.get_default('checksum_executor'))
+            except OSError as e:
+                result['failed'].append((key, ResponseInfo(None, e)))
+                return
+            computed.append((path, st, etag))
+            await flush_computed()
+        if etag == remote_hash:
+            result['skipped'] += 1
+        else:
+            await upload_queue.put((key, path))
+
+    async def remove(key):
+        ret, info = await bucket.delete(key)
+        if info.ok():
+            result['deleted'] += 1
+        else:
+            result['failed'].append((key, info))
+
+    async def collect(uploads):
+        async for key, _, ret, info in uploads:
+            if ret is None:
+                result['failed'].append((key, info))
+            else:
+                result['uploaded'] += 1
+
+    async def compare_batch(batch):
+        # 先批量查询etag缓存，只有缓存失效的文件交给计算etag的消费者
+        etags = await cache.get_many([(path, st) for _, path, st, _ in batch])
+        for key, path, st, remote_hash in batch:
+            await hash_queue.put((key, path, st, remote_hash, etags.get(path)))
+
+    uploads = bucket.put_many(changed_items(), workers=workers, **options)
+    collector = asyncio.ensure_future(collect(uploads))
+    hash_queue = asyncio.Queue(hash_workers * 2)
+    hashers = _start_workers(hash_queue, hash_workers, compare)
+    delete_queue = asyncio.Queue(workers * 2)
+    deleters = _start_workers(delete_queue, workers, remove) if delete else []
+    try:
+        batch = []
+        async for item in bucket.iter_keys(prefix=prefix or None):
+            key = item['key']
+            if key in local:
+                path, st = local.pop(key)
+                batch.append((key, path, st, item['hash']))
+                if len(batch) >= ETAG_BATCH_SIZE:
+                    await compare_batch(batch)
+                    batch = []
+            elif delete:
+                await delete_queue.put(key)
+        if batch:
+            await compare_batch(batch)
+
+        for key, (path, _) in sorted(local.items()):
+            await upload_queue.put((key, path))
+
+        await _stop_workers(hash_queue, hashers)
+        await flush_computed(force=True)
+        await upload_queue.put(_DONE)
+        await collector
+        await _stop_workers(delete_queue, deleters)
+    finally:
+        for task in hashers + deleters + [collector]:
+            task.cancel()
+        await uploads.close()
+        if etag_cache is None:
+            await cache.close()
+
+    result['stats'] = uploads.stats
+    logger.info(f'sync_dir {local_dir} => {prefix}: uploaded {result["uploaded"]}, skipped {result["skipped"]}, '
+                f'deleted {result["deleted"]}, failed {len(result["failed"])}')
+    return result
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import time
+
+from aiohttp import payload
+
+
+PACE_SIZE = 1024 * 64  # 限速时每次写入socket的字节数
+
+
+class TokenBucket(object):
+    """字节令牌桶
+
+    按 rate 字节/秒生成令牌，最多积累 burst 个。令牌不足时允许透支，调用者按透支量等待，
+    因此先到的请求先获得带宽。rate 可在运行时通过 set_rate 调整，对之后的写入立即生效
+
+    Attributes:
+        rate:   每秒字节数，为None或0时不限速
+        burst:  最多积累的令牌数，默认为一秒的流量
+    """
+
+    def __init__(self, rate=None, burst=None):
+        self.rate = None
+        self.burst = None
+        self._tokens = 0
+        self._last = time.monotonic()
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate, burst=None):
+        """调整速率
+
+        Args:
+            rate:   每秒字节数，为None或0时不限速
+            burst:  最多积累的令牌数，默认为一秒的流量
+
+        Raises:
+            ValueError: rate或burst为负数
+        """
+        if (rate is not None and rate < 0) or (burst is not None and burst < 0):
+            raise ValueError('rate and burst must not be negative')
+        rate = rate or None
+        self._refill()
+        burst = burst or rate
+        if rate is None:
+            self._tokens = 0
+        elif self.rate is None:
+            # 从不限速切换为限速时令牌桶是满的
+            self._tokens = burst
+        else:
+            self._tokens = min(self._tokens, burst)
+        self.rate = rate
+        self.burst = burst
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate is not None:
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def reserve(self, size):
+        """预留size个令牌，返回需要等待的秒数"""
+        if self.rate is None:
+            return 0
+        self._refill()
+        self._tokens -= size
+        return -self._tokens / self.rate if self._tokens < 0 else 0
+
+
+class Throttle(object):
+    """多级限速
+
+    一次写入需同时满足所有层级的令牌桶，如 租户 -> 空间 -> AsyncCow -> 进程，等待时间取各层级中最长的
+    """
+
+    def __init__(self, *buckets):
+        self.buckets = [bucket for bucket in buckets if bucket is not None]
+
+    @property
+    def limited(self):
+        return any(bucket.rate is not None for bucket in self.buckets)
+
+    async def consume(self, size):
+        delay = max([bucket.reserve(size) for bucket in self.buckets] or [0])
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def wrap(self, data):
+        """限速时将bytes-like的请求体包装为匀速写入的Payload，否则原样返回"""
+        if self.limited and isinstance(data, (bytes, bytearray, memoryview)):
+            return ThrottledPayload(data, self)
+        return data
+
+
+class ThrottledPayload(payload.Payload):
+    """匀速写入的请求体
+
+    长度已知，按 PACE_SIZE 分段写入，每段写入前从 Throttle 获取令牌，避免突发流量
+    """
+
+    _autoclose = True
+
+    def __init__(self, value, throttle, *args, **kwargs):
+        kwargs.setdefault('content_type', 'application/octet-stream')
+        super().__init__(value, *args, **kwargs)
+        self._size = memoryview(value).nbytes
+        self._throttle = throttle
+
+    def decode(self, encoding='utf-8', errors='strict'):
+        return bytes(self._value).decode(encoding, errors)
+
+    async def as_bytes(self, encoding='utf-8', errors='strict'):
+        return bytes(self._value)
+
+    async def write(self, writer):
+        await self.write_with_length(writer, None)
+
+    async def write_with_length(self, writer, content_length):
+        view = memoryview(self._value).cast('B')
+        if content_length is not None:
+            view = view[:content_length]
+
+        for start in range(0, len(view), PACE_SIZE):
+            piece = view[start:start + PACE_SIZE]
+            await self._throttle.consume(len(piece))
+            await writer.write(piece)
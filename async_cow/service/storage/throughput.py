@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from collections import deque
+
+
+SMALL_REQUEST_SIZE = 1024 * 64  # 不超过该大小的请求耗时近似为一次RTT
+TARGET_SECONDS = 2  # 自适应分片时单个分片的目标传输时长
+RTT_OVERHEAD = 0.1  # 单个分片中RTT开销所占的最大比例
+
+
+class _HostStat(object):
+
+    def __init__(self):
+        self.bandwidth = None
+        self.rtt = None
+        self.failure_rate = 0.0
+        self.samples = 0
+        self.in_flight = 0
+        self.busy_area = 0.0  # 同时进行的请求数对时间的积分
+        self.updated_at = time.monotonic()
+
+    def advance(self):
+        now = time.monotonic()
+        self.busy_area += self.in_flight * (now - self.updated_at)
+        self.updated_at = now
+        return now
+
+
+class ThroughputEstimator(object):
+    """上传吞吐量估计类
+
+    按上传域名统计带宽、RTT及失败率的指数加权移动平均(EWMA)，据此为分片上传选择分片大小：
+    快速链路使用大分片减少往返次数，高失败率链路使用小分片降低重传代价。
+    上传时通过 begin/end 记录请求，按同一域名的并发请求数折算带宽，并发或限速不会使估计值偏小。
+    每次选择的结果保存在 decisions 中，便于审计和上报监控
+
+    Attributes:
+        alpha:      EWMA平滑系数，越大越偏向最近的样本
+        decisions:  最近的分片大小选择记录
+    """
+
+    def __init__(self, alpha=0.3, max_decisions=1000):
+        self.alpha = alpha
+        self.decisions = deque(maxlen=max_decisions)
+        self._stats = {}
+
+    def _ewma(self, current, sample):
+        if current is None:
+            return sample
+        return current + self.alpha * (sample - current)
+
+    def _sample_bandwidth(self, stat, size, elapsed):
+        transfer = max(elapsed - (stat.rtt or 0), elapsed * RTT_OVERHEAD, 1e-3)
+        stat.bandwidth = self._ewma(stat.bandwidth, size / transfer)
+
+    def _count(self, stat, size, elapsed, success):
+        # 记录失败率及RTT，返回请求体是否可以作为带宽样本
+        stat.failure_rate = self._ewma(stat.failure_rate, 0.0 if success else 1.0)
+        if not success:
+            return False
+        stat.samples += 1
+        if size <= SMALL_REQUEST_SIZE:
+            stat.rtt = self._ewma(stat.rtt, elapsed)
+            return False
+        return True
+
+    def observe(self, host, size, elapsed, success=True):
+        """记录一次独立的请求
+
+        Args:
+            host:       上传域名
+            size:       请求体字节数
+            elapsed:    请求耗时，单位秒
+            success:    请求是否成功
+        """
+        stat = self._stats.setdefault(host, _HostStat())
+        if self._count(stat, size, elapsed, success):
+            self._sample_bandwidth(stat, size, elapsed)
+
+    def begin(self, host):
+        """记录请求开始
+
+        Returns:
+            传给 end 的标记
+        """
+        stat = self._stats.setdefault(host, _HostStat())
+        now = stat.advance()
+        stat.in_flight += 1
+        return now, stat.busy_area
+
+    def end(self, host, token, size, success=True, throttled=False):
+        """记录请求结束
+
+        同一域名的请求共享带宽，以请求期间平均的并发请求数乘以单个请求的速率作为该域名的带宽样本
+
+        Args:
+            host:       上传域名
+            token:      begin 返回的标记
+            size:       请求体字节数
+            success:    请求是否成功，为None时不计入统计（如非网络原因的失败或取消）
+            throttled:  请求是否受上传限速约束，受约束的请求不作为带宽样本
+        """
+        stat = self._stats.setdefault(host, _HostStat())
+        now = stat.advance()
+        stat.in_flight -= 1
+
+        start, busy_area = token
+        elapsed = now - start
+        if success is None or not self._count(stat, size, elapsed, success) or throttled or elapsed <= 0:
+            return
+        concurrency = max(1.0, (stat.busy_area - busy_area) / elapsed)
+        self._sample_bandwidth(stat, size * concurrency, elapsed)
+
+    def stats(self, host):
+        """返回域名当前的估计值
+
+        Returns:
+            一个dict变量，包含 bandwidth(字节/秒)、rtt(秒)、failure_rate 以及 samples，没有样本时返回None
+        """
+        stat = self._stats.get(host)
+        if stat is None:
+            return None
+        return {
+            'bandwidth': stat.bandwidth,
+            'rtt': stat.rtt,
+            'failure_rate': stat.failure_rate,
+            'samples': stat.samples,
+        }
+
+    def choose_size(self, host, default, minimum, maximum, align, kind='part'):
+        """根据估计值选择分片大小
+
+        Args:
+            host:       上传域名
+            default:    没有带宽样本时使用的大小
+            minimum:    最小分片大小
+            maximum:    最大分片大小
+            align:      分片大小按该值向下对齐
+            kind:       分片类型，仅用于记录
+
+        Returns:
+            分片大小
+        """
+        stat = self._stats.get(host)
+        if stat is None or stat.bandwidth is None:
+            size = default
+        else:
+            # 单个分片传输约 TARGET_SECONDS 秒，且RTT开销不超过 RTT_OVERHEAD
+            size = stat.bandwidth * TARGET_SECONDS
+            if stat.rtt:
+                size = max(size, stat.bandwidth * stat.rtt / RTT_OVERHEAD)
+            # 失败率越高分片越小，重传的代价越低
+            size *= (1 - stat.failure_rate) ** 2
+
+        size = int(min(max(size, minimum), maximum)) // align * align
+        size = max(size, minimum)
+
+        decision = {
+            'time': time.time(),
+            'host': host,
+            'kind': kind,
+            'size': size,
+        }
+        decision.update(self.stats(host) or {})
+        self.decisions.append(decision)
+
+        return size
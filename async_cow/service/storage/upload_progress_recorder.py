@@ -1,10 +1,17 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
 import hashlib
 import json
 import os
+import sqlite3
 import tempfile
-from qiniu.compat import is_py2
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+RECORD_TTL = 7 * 24 * 3600  # 服务端上传上下文的有效期，超过该时长的记录不再可用
 
 
 class UploadProgressRecorder(object):
@@ -16,8 +23,12 @@ class UploadProgressRecorder(object):
         "size": file_size,
         "offset": upload_offset,
         "modify_time": file_modify_time,
-        "contexts": contexts
+        "contexts": contexts,
+        "expired_at": expired_at
     }
+    contexts 与 expired_at 按块序号排列，未完成的块为null
+
+    记录先写入临时文件再原子重命名，中途崩溃不会留下损坏的记录；读取或删除不存在的记录不会报错
 
     Attributes:
         record_folder: 保存上传记录的目录
@@ -27,36 +38,204 @@ class UploadProgressRecorder(object):
         self.record_folder = record_folder
 
     def get_upload_record(self, file_name, key):
-        record_key = '{0}/{1}'.format(key, file_name)
-        if is_py2:
-            record_file_name = hashlib.md5(record_key).hexdigest()
-        else:
-            record_file_name = hashlib.md5(record_key.encode('utf-8')).hexdigest()
-
-        upload_record_file_path = os.path.join(self.record_folder, record_file_name)
-        if not os.path.isfile(upload_record_file_path):
-            return None
-        with open(upload_record_file_path, 'r') as f:
-            json_data = json.load(f)
-        return json_data
+        return self._read_record(self._record_path(file_name, key))
 
     def set_upload_record(self, file_name, key, data):
+        self._write_record(self._record_path(file_name, key), data)
+
+    def delete_upload_record(self, file_name, key):
+        self._remove_record(self._record_path(file_name, key))
+
+    def _record_path(self, file_name, key):
         record_key = '{0}/{1}'.format(key, file_name)
-        if is_py2:
-            record_file_name = hashlib.md5(record_key).hexdigest()
-        else:
-            record_file_name = hashlib.md5(record_key.encode('utf-8')).hexdigest()
+        record_file_name = hashlib.md5(record_key.encode('utf-8')).hexdigest()
+        return os.path.join(self.record_folder, record_file_name)
 
-        upload_record_file_path = os.path.join(self.record_folder, record_file_name)
-        with open(upload_record_file_path, 'w') as f:
+    @staticmethod
+    def _read_record(path):
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_record(path, data):
+        temp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'w') as f:
             json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
 
-    def delete_upload_record(self, file_name, key):
-        record_key = '{0}/{1}'.format(key, file_name)
-        if is_py2:
-            record_file_name = hashlib.md5(record_key).hexdigest()
-        else:
-            record_file_name = hashlib.md5(record_key.encode('utf-8')).hexdigest()
+    @staticmethod
+    def _remove_record(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class AsyncUploadProgressRecorder(UploadProgressRecorder):
+    """异步持久化上传记录类
+
+    所有方法均为协程，文件读写在执行器中进行，不阻塞事件循环。
+    set_upload_record 只更新内存中的最新记录，delay 秒的时间窗口内同一文件的多次更新合并为一次写入，
+    多个文件的记录在同一批次中写入。上传失败或退出前可调用 flush 立即落盘
+
+    Attributes:
+        record_folder: 保存上传记录的目录
+        delay:         合并写入的时间窗口，单位秒
+        executor:      执行文件读写的线程池，为None时使用事件循环默认线程池
+    """
+
+    def __init__(self, record_folder=tempfile.gettempdir(), delay=1, executor=None):
+        super().__init__(record_folder)
+
+        self.delay = delay
+        self.executor = executor
+
+        self._pending = {}
+        self._flush_task = None
+        self._lock = None
+
+    @property
+    def lock(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def _run(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(self.executor, func, *args)
+
+    async def get_upload_record(self, file_name, key):
+        path = self._record_path(file_name, key)
+        if path in self._pending:
+            return self._pending[path]
+        return await self._run(self._read_record, path)
+
+    async def set_upload_record(self, file_name, key, data):
+        self._pending[self._record_path(file_name, key)] = data
+
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._delayed_flush())
+
+    async def delete_upload_record(self, file_name, key):
+        path = self._record_path(file_name, key)
+        self._pending.pop(path, None)
+
+        # 等待进行中的写入完成，避免删除后又被旧记录覆盖
+        async with self.lock:
+            await self._run(self._remove_record, path)
+
+    async def flush(self):
+        """立即写入所有待写入的记录"""
+        async with self.lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            await self._run(self._write_records, pending)
+
+    async def _delayed_flush(self):
+        while self._pending:
+            await asyncio.sleep(self.delay)
+            await self.flush()
+
+    @classmethod
+    def _write_records(cls, records):
+        for path, data in records.items():
+            cls._write_record(path, data)
+
+
+class SqliteUploadProgressRecorder(AsyncUploadProgressRecorder):
+    """基于SQLite的持久化上传记录类
+
+    所有上传记录保存在同一个WAL模式的SQLite数据库中，以(key, file_name)为主键检索，适用于大量并发的断点续传。
+    数据库只在专用的单线程执行器中访问；时间窗口内合并的更新在一个事务中批量提交；
+    超过 ttl 的记录视为失效，并定期清理
+
+    Attributes:
+        db_path:        数据库文件路径，默认位于系统临时目录
+        ttl:            记录有效期，单位秒，默认与服务端上传上下文的有效期一致
+        delay:          合并写入的时间窗口，单位秒
+        gc_interval:    清理过期记录的最小间隔，单位秒
+    """
+
+    def __init__(self, db_path=None, ttl=RECORD_TTL, delay=1, gc_interval=3600):
+        if db_path is None:
+            db_path = os.path.join(tempfile.gettempdir(), 'async_cow_upload_records.db')
+
+        super().__init__(os.path.dirname(os.path.abspath(db_path)), delay, ThreadPoolExecutor(max_workers=1))
+
+        self.db_path = db_path
+        self.ttl = ttl
+        self.gc_interval = gc_interval
+
+        self._conn = None
+        self._last_gc = 0
+
+    async def close(self):
+        """写入待写入的记录并关闭数据库"""
+        await self.flush()
+        await self._run(self._close)
+        self.executor.shutdown(wait=False)
+
+    def _record_path(self, file_name, key):
+        # 记录以(key, file_name)标识，而非文件路径
+        return ('' if key is None else key, '' if file_name is None else file_name)
+
+    def _connect(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            with conn:
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS upload_record ('
+                    'key TEXT NOT NULL, file_name TEXT NOT NULL, data TEXT NOT NULL, updated_at REAL NOT NULL, '
+                    'PRIMARY KEY (key, file_name))'
+                )
+                conn.execute('CREATE INDEX IF NOT EXISTS upload_record_updated_at ON upload_record (updated_at)')
+            self._conn = conn
+            self._collect_garbage()
+        return self._conn
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _collect_garbage(self):
+        now = time.time()
+        with self._conn:
+            self._conn.execute('DELETE FROM upload_record WHERE updated_at < ?', (now - self.ttl,))
+        self._last_gc = now
+
+    def _read_record(self, record_id):
+        row = self._connect().execute(
+            'SELECT data, updated_at FROM upload_record WHERE key = ? AND file_name = ?', record_id
+        ).fetchone()
+        if row is None or row[1] < time.time() - self.ttl:
+            return None
+        try:
+            return json.loads(row[0])
+        except ValueError:
+            return None
+
+    def _write_records(self, records):
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO upload_record (key, file_name, data, updated_at) VALUES (?, ?, ?, ?)',
+                [(key, file_name, json.dumps(data), now) for (key, file_name), data in records.items()]
+            )
+        if now - self._last_gc >= self.gc_interval:
+            self._collect_garbage()
 
-        upload_record_file_path = os.path.join(self.record_folder, record_file_name)
-        os.remove(upload_record_file_path)
+    def _remove_record(self, record_id):
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM upload_record WHERE key = ? AND file_name = ?', record_id)
@@ -1,6 +1,11 @@
 
 # -*- coding: utf-8 -*-
 
+import asyncio
+import mmap
+import os
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from hashlib import sha1
 from base64 import urlsafe_b64encode, urlsafe_b64decode
 from datetime import datetime
@@ -14,6 +19,11 @@ except ImportError:
     zlib = None
     import binascii
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 _BLOCK_SIZE = 1024 * 1024 * 4
 
 
@@ -76,6 +86,29 @@ def crc32(data):
     return binascii.crc32(b(data)) & 0xffffffff
 
 
+async def crc32_async(data, executor=None, inline_threshold=0):
+    """在执行器中计算输入流的crc32检验码，避免阻塞事件循环:
+
+    zlib.crc32 计算时会释放GIL，线程池即可与事件循环并行
+
+    Args:
+        data:             待计算校验码的字符流
+        executor:         线程池或进程池，为None时使用事件循环默认线程池
+        inline_threshold: 数据长度不超过该值时直接在当前线程计算
+
+    Returns:
+        输入流的crc32校验码。
+    """
+    if len(data) <= inline_threshold:
+        return crc32(data)
+
+    # memoryview不能跨进程传递
+    if isinstance(executor, ProcessPoolExecutor) and isinstance(data, (memoryview, bytearray)):
+        data = bytes(data)
+
+    return await asyncio.get_event_loop().run_in_executor(executor, crc32, data)
+
+
 async def _file_iter(input_stream, size, offset=0):
     """异步读取输入流，用于大文件:
 
@@ -93,6 +126,462 @@ async def _file_iter(input_stream, size, offset=0):
         d = await input_stream.read(size)
 
 
+class _BytesReader(object):
+    """以异步流接口读取内存数据，read返回memoryview切片，不产生拷贝"""
+
+    def __init__(self, data):
+        self._view = memoryview(data).cast('B')
+        self._position = 0
+
+    async def seek(self, offset):
+        self._position = offset
+
+    async def read(self, size=-1):
+        start = self._position
+        end = len(self._view) if size is None or size < 0 else min(start + size, len(self._view))
+        self._position = max(start, end)
+        return self._view[start:end]
+
+
+class _SyncReader(object):
+    """以异步流接口读取同步的文件对象"""
+
+    def __init__(self, stream):
+        self._stream = stream
+        if hasattr(stream, 'readinto'):
+            self.readinto = self._readinto
+        if hasattr(stream, 'seek') and (not hasattr(stream, 'seekable') or stream.seekable()):
+            self.seek = self._seek
+
+    async def _seek(self, offset):
+        self._stream.seek(offset)
+
+    async def read(self, size=-1):
+        return b(self._stream.read(size))
+
+    async def _readinto(self, buffer):
+        return self._stream.readinto(buffer)
+
+
+class _AsyncIterReader(object):
+    """以异步流接口读取同步或异步可迭代对象，数据块长度任意，不支持seek"""
+
+    def __init__(self, iterable):
+        if hasattr(iterable, '__aiter__'):
+            self._iterator = iterable.__aiter__()
+        else:
+            self._iterator = self._sync_iter(iterable)
+        self._buffer = bytearray()
+        self._eof = False
+
+    @staticmethod
+    async def _sync_iter(iterable):
+        for chunk in iterable:
+            yield chunk
+
+    async def read(self, size=-1):
+        while not self._eof and (size is None or size < 0 or len(self._buffer) < size):
+            try:
+                chunk = await self._iterator.__anext__()
+            except StopAsyncIteration:
+                self._eof = True
+            else:
+                self._buffer += b(chunk)
+
+        if size is None or size < 0:
+            size = len(self._buffer)
+
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+def _async_reader(data):
+    """将各类输入包装为支持异步read的流对象:
+
+    支持 bytes/bytearray/memoryview、同步或异步的文件对象（含aiofiles、aiohttp.StreamReader）、同步或异步可迭代对象
+
+    Args:
+        data: 待读取的数据
+
+    Returns:
+        支持异步read的流对象，可seek的输入同时支持异步seek
+
+    Raises:
+        TypeError: 不支持的输入类型
+    """
+    if isinstance(data, str):
+        data = b(data)
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return _BytesReader(data)
+    if hasattr(data, 'read'):
+        if asyncio.iscoroutinefunction(data.read):
+            return data
+        return _SyncReader(data)
+    if hasattr(data, '__aiter__') or hasattr(data, '__iter__'):
+        return _AsyncIterReader(data)
+    raise TypeError('unsupported data type: {0}'.format(type(data)))
+
+
+async def _iter_stream(input_stream, size, head=()):
+    """异步迭代输入流，先产出已读取的数据块:
+
+    Args:
+        input_stream: 支持异步read的输入流
+        size:         每次读取的大小
+        head:         已从输入流中读出的数据块
+    """
+    for chunk in head:
+        yield chunk
+
+    while True:
+        chunk = await input_stream.read(size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _compressor(method):
+    """创建流式压缩对象:
+
+    Args:
+        method: 压缩算法，'gzip' 或 'zstd'，zstd需要安装zstandard
+
+    Returns:
+        支持compress和flush的压缩对象
+
+    Raises:
+        ValueError: 不支持的压缩算法
+        ImportError: 压缩算法依赖的模块未安装
+    """
+    if method == 'gzip':
+        if zlib is None:
+            raise ImportError('zlib is required for gzip compression')
+        # wbits为31时输出gzip格式
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    if method == 'zstd':
+        if zstandard is None:
+            raise ImportError('zstandard is required for zstd compression')
+        return zstandard.ZstdCompressor().compressobj()
+    raise ValueError('unsupported compress method: {0}'.format(method))
+
+
+def _compress_params(params, method):
+    # 通过自定义元数据记录压缩算法，使用者已指定时不覆盖。
+    # 自定义元数据下载时以 X-Qn-Meta-Content-Encoding 响应头返回，不是HTTP的Content-Encoding，下载方需自行解压
+    params = dict(params or {})
+    params.setdefault('x-qn-meta-Content-Encoding', method)
+    return params
+
+
+def _check_compress_options(**options):
+    """压缩后长度未知，只能流式上传，断点续传、v2、mmap等参数无法生效，指定时抛出ValueError"""
+    conflicts = sorted(name for name, value in options.items() if value)
+    if conflicts:
+        raise ValueError('compress can not be used with {0}'.format(', '.join(conflicts)))
+
+
+async def _compress_stream(data, compressor, executor=None, size=_BLOCK_SIZE):
+    """流式压缩输入数据:
+
+    每次读取size字节在执行器中压缩，不阻塞事件循环；上传时预读后续块，压缩与网络传输重叠
+
+    Args:
+        data:       待压缩的数据，支持的类型同 _async_reader
+        compressor: _compressor 返回的压缩对象
+        executor:   执行压缩的执行器，None为事件循环默认线程池
+        size:       每次读取的大小
+    """
+    reader = _async_reader(data)
+    loop = asyncio.get_event_loop()
+    while True:
+        chunk = await reader.read(size)
+        if not chunk:
+            break
+        compressed = await loop.run_in_executor(executor, compressor.compress, chunk)
+        if compressed:
+            yield compressed
+
+    compressed = await loop.run_in_executor(executor, compressor.flush)
+    if compressed:
+        yield compressed
+
+
+class _BlockPrefetcher(object):
+    """异步预读输入流，用于大文件:
+
+    后台任务提前读取后续的块放入有界队列，上传当前块的同时读取下一块，使磁盘读取与网络传输重叠。
+    块数据读入可复用的缓冲区并以memoryview形式返回，使用者处理完一个块后须调用release归还缓冲区，
+    输入流不支持readinto时退化为read，返回bytes且不复用缓冲区。
+
+    Args:
+        input_stream: 待读取文件的二进制流，需支持异步的read，从非零偏移或按区间读取时需支持异步的seek
+        size:         块大小
+        offset:       起始偏移，顺序读取至流末尾
+        read_ahead:   预读块数
+        buffers:      缓冲区个数上限，应不小于预读块数加上同时处理中的块数
+        ranges:       (offset, length)列表，指定后只读取这些区间，offset参数被忽略
+
+    Raises:
+        IOError: 文件流读取失败
+    """
+
+    def __init__(self, input_stream, size, offset=0, read_ahead=2, buffers=None, ranges=None):
+        self._input_stream = input_stream
+        self._size = size
+        self._offset = offset
+        self._ranges = ranges
+        self._position = None
+
+        self._queue = asyncio.Queue(maxsize=max(1, read_ahead))
+        self._free_buffers = asyncio.Queue()
+        self._buffer_ids = set()
+        self._max_buffers = buffers or (max(1, read_ahead) + 2)
+
+        self._task = None
+
+    def __aiter__(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._produce())
+        return self
+
+    async def __anext__(self):
+        item = await self._queue.get()
+        if item is None:
+            raise StopAsyncIteration()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    async def close(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def release(self, block):
+        """归还块所使用的缓冲区"""
+        if isinstance(block, memoryview) and id(block.obj) in self._buffer_ids:
+            self._free_buffers.put_nowait(block.obj)
+
+    async def _get_buffer(self):
+        if self._free_buffers.empty() and len(self._buffer_ids) < self._max_buffers:
+            buffer = bytearray(self._size)
+            self._buffer_ids.add(id(buffer))
+            return buffer
+        return await self._free_buffers.get()
+
+    def _iter_ranges(self):
+        if self._ranges is not None:
+            for offset, length in self._ranges:
+                yield offset, length
+        else:
+            offset = self._offset
+            while True:
+                yield offset, self._size
+                offset += self._size
+
+    async def _read(self, offset, length):
+        # 不可seek的流只能从头顺序读取
+        if self._position is None and not hasattr(self._input_stream, 'seek'):
+            self._position = 0
+        if self._position != offset:
+            await self._input_stream.seek(offset)
+            self._position = offset
+
+        if not hasattr(self._input_stream, 'readinto'):
+            # read可能返回不足length的数据（如网络流），读满一块或到达末尾为止
+            pieces = []
+            filled = 0
+            while filled < length:
+                data = await self._input_stream.read(length - filled)
+                if not data:
+                    break
+                pieces.append(data)
+                filled += len(data)
+            self._position += filled
+            return pieces[0] if len(pieces) == 1 else b''.join(pieces)
+
+        buffer = await self._get_buffer()
+        view = memoryview(buffer)
+        filled = 0
+        while filled < length:
+            count = await self._input_stream.readinto(view[filled:length])
+            if not count:
+                break
+            filled += count
+        self._position += filled
+
+        if filled == 0:
+            self._free_buffers.put_nowait(buffer)
+            return b''
+        return view[:filled]
+
+    async def _produce(self):
+        try:
+            for offset, length in self._iter_ranges():
+                block = await self._read(offset, length)
+                if len(block) == 0:
+                    break
+                await self._queue.put(block)
+                if self._ranges is None and len(block) < length:
+                    break
+            await self._queue.put(None)
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            await self._queue.put(err)
+
+
+class _BlockFanout(object):
+    """一次读取、多个使用者共享的块读取器:
+
+    所有使用者通过subscribe加入后，从各自起始偏移中最小的位置开始只读取一次输入流，每个块依次分发给各使用者，
+    块的缓冲区在所有使用者release后才归还。各使用者的队列有界，读取速度受最慢的使用者约束。
+    同一块内同一区间的crc32只计算一次
+
+    Args:
+        input_stream: 待读取文件的二进制流
+        size:         块大小
+        count:        使用者个数，全部subscribe或leave后才开始读取
+        read_ahead:   预读块数
+        buffers:      缓冲区个数上限，应不小于预读块数加上单个使用者同时处理中的块数
+    """
+
+    def __init__(self, input_stream, size, count, read_ahead=2, buffers=None):
+        self._input_stream = input_stream
+        self._size = size
+        self._pending = count
+        self._read_ahead = read_ahead
+        self._buffers = buffers
+
+        self._subscribers = []
+        self._reader = None
+        self._task = None
+
+        # id(block) -> [块序号, 未release的使用者数]
+        self._refs = {}
+        # 块序号 -> {(offset, length): crc32的Future}
+        self._crcs = {}
+
+    def subscribe(self, offset):
+        """加入并返回一个从offset开始的块迭代器，offset须为块大小的整数倍"""
+        subscriber = _BlockSubscriber(self, offset // self._size)
+        self._subscribers.append(subscriber)
+        self._leave()
+        return subscriber
+
+    def leave(self):
+        """未subscribe就结束的使用者须调用leave，避免其它使用者一直等待"""
+        self._leave()
+
+    def _leave(self):
+        self._pending -= 1
+        if self._pending == 0 and self._subscribers:
+            start = min(subscriber.start for subscriber in self._subscribers)
+            self._reader = _BlockPrefetcher(self._input_stream, self._size, offset=start * self._size,
+                                            read_ahead=self._read_ahead, buffers=self._buffers)
+            self._task = asyncio.ensure_future(self._produce(start))
+
+    async def crc32(self, index, offset, chunk, executor=None, inline_threshold=0):
+        """计算块内区间的crc32，多个使用者请求同一区间时只计算一次"""
+        crcs = self._crcs.setdefault(index, {})
+        key = (offset, len(chunk))
+        future = crcs.get(key)
+        if future is None:
+            future = crcs[key] = asyncio.ensure_future(crc32_async(chunk, executor, inline_threshold))
+        return await asyncio.shield(future)
+
+    def _release(self, block):
+        ref = self._refs.get(id(block))
+        if ref is None:
+            return
+        ref[1] -= 1
+        if ref[1] == 0:
+            del self._refs[id(block)]
+            self._crcs.pop(ref[0], None)
+            self._reader.release(block)
+
+    async def _produce(self, index):
+        try:
+            async for block in self._reader:
+                subscribers = [sub for sub in self._subscribers if not sub.closed and sub.start <= index]
+                if subscribers:
+                    self._refs[id(block)] = [index, len(subscribers)]
+                    for subscriber in subscribers:
+                        await subscriber.put((index, block))
+                else:
+                    self._reader.release(block)
+                index += 1
+            items = [None]
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            items = [err]
+        finally:
+            await self._reader.close()
+
+        for subscriber in self._subscribers:
+            await subscriber.put(items[0])
+
+    async def _close(self):
+        if self._task is not None and all(subscriber.closed for subscriber in self._subscribers):
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+class _BlockSubscriber(object):
+    """_BlockFanout 的使用者，接口与 _BlockPrefetcher 相同"""
+
+    def __init__(self, fanout, start):
+        self.start = start
+        self.closed = False
+        self.index = None
+        self._fanout = fanout
+        self._queue = asyncio.Queue(maxsize=1)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        item = await self._queue.get()
+        if item is None:
+            raise StopAsyncIteration()
+        if isinstance(item, Exception):
+            raise item
+        self.index, block = item
+        return block
+
+    async def put(self, item):
+        if self.closed:
+            self._discard(item)
+            return
+        await self._queue.put(item)
+        if self.closed:
+            self._drain()
+
+    def release(self, block):
+        self._fanout._release(block)
+
+    async def close(self):
+        self.closed = True
+        self._drain()
+        await self._fanout._close()
+
+    def _discard(self, item):
+        if isinstance(item, tuple):
+            self._fanout._release(item[1])
+
+    def _drain(self):
+        while not self._queue.empty():
+            self._discard(self._queue.get_nowait())
+
+
 def _sync_file_iter(input_stream, size, offset=0):
     """同步读取输入流，用于小文件:
 
@@ -135,30 +624,136 @@ def etag_stream(input_stream):
     Returns:
         输入流的etag值
     """
-    array = [_sha1(block) for block in _file_iter(input_stream, _BLOCK_SIZE)]
-    if len(array) == 0:
-        array = [_sha1(b'')]
-    if len(array) == 1:
-        data = array[0]
-        prefix = b'\x16'
-    else:
-        sha1_str = b('').join(array)
-        data = _sha1(sha1_str)
-        prefix = b'\x96'
-    return urlsafe_base64_encode(prefix + data)
+    array = [_sha1(block) for block in _sync_file_iter(input_stream, _BLOCK_SIZE)]
+    return urlsafe_base64_encode(_etag_from_sha1s(array))
 
 
-def etag(filePath):
+def etag(filePath, executor=None):
     """计算文件的etag:
 
+    各块的sha1在线程池或进程池中并行计算，文件以mmap方式读取
+
+    Args:
+        filePath: 待计算etag的文件路径
+        executor: 计算sha1的执行器，为None时使用模块内共享的线程池
+
+    Returns:
+        输入文件的etag值
+    """
+    size = os.path.getsize(filePath)
+    return urlsafe_base64_encode(_etag_from_sha1s(_file_sha1s(filePath, 0, size, executor)))
+
+
+def etag_v2(filePath, part_size, executor=None):
+    """计算分片上传v2文件的etag:
+
+    分片大小为4MB，或只有一个不超过4MB的分片时与etag相同；
+    否则先按etag算法计算每个分片的sha1，再对所有分片的sha1拼接后计算sha1，前缀为0x9e
+
+    Args:
+        filePath:   待计算etag的文件路径
+        part_size:  上传时使用的分片大小
+        executor:   计算sha1的执行器，为None时使用模块内共享的线程池
+
+    Returns:
+        输入文件的etag值
+    """
+    size = os.path.getsize(filePath)
+    if _is_v1_parts(size, part_size):
+        return etag(filePath, executor)
+
+    parts = [_etag_from_sha1s(_file_sha1s(filePath, offset, min(part_size, size - offset), executor))[1:]
+             for offset in range(0, size, part_size)]
+    return urlsafe_base64_encode(b'\x9e' + _sha1(b''.join(parts)))
+
+
+async def etag_async(filePath, executor=None):
+    """异步计算文件的etag:
+
+    各块的sha1在执行器中并行计算，不阻塞事件循环
+
     Args:
         filePath: 待计算etag的文件路径
+        executor: 计算sha1的执行器，可以是线程池或进程池，为None时使用事件循环默认线程池
 
     Returns:
         输入文件的etag值
     """
+    size = os.path.getsize(filePath)
+    return urlsafe_base64_encode(_etag_from_sha1s(await _file_sha1s_async(filePath, 0, size, executor)))
+
+
+async def etag_v2_async(filePath, part_size, executor=None):
+    """异步计算分片上传v2文件的etag，规格见etag_v2"""
+    size = os.path.getsize(filePath)
+    if _is_v1_parts(size, part_size):
+        return await etag_async(filePath, executor)
+
+    parts = await asyncio.gather(*[
+        _file_sha1s_async(filePath, offset, min(part_size, size - offset), executor)
+        for offset in range(0, size, part_size)
+    ])
+    return urlsafe_base64_encode(b'\x9e' + _sha1(b''.join(_etag_from_sha1s(part)[1:] for part in parts)))
+
+
+def _etag_from_sha1s(array):
+    # 按块的sha1列表计算带前缀的etag
+    if len(array) == 0:
+        array = [_sha1(b'')]
+    if len(array) == 1:
+        return b'\x16' + array[0]
+    return b'\x96' + _sha1(b('').join(array))
+
+
+def _is_v1_parts(size, part_size):
+    # 除最后一片外都是4MB且最后一片不超过4MB时，v2与v1的etag相同
+    return part_size == _BLOCK_SIZE or size <= min(part_size, _BLOCK_SIZE)
+
+
+def _block_sha1(filePath, offset, length):
+    """以mmap方式读取文件的一段并计算sha1，可在线程池或进程池中执行"""
+    if length == 0:
+        return _sha1(b'')
+    # mmap的偏移量需按内存分配粒度对齐
+    start = offset - offset % mmap.ALLOCATIONGRANULARITY
     with open(filePath, 'rb') as f:
-        return etag_stream(f)
+        with mmap.mmap(f.fileno(), length + offset - start, access=mmap.ACCESS_READ, offset=start) as mapped:
+            view = memoryview(mapped)
+            try:
+                return _sha1(view[offset - start:])
+            finally:
+                view.release()
+
+
+def _block_ranges(offset, length):
+    return [(start, min(_BLOCK_SIZE, offset + length - start))
+            for start in range(offset, offset + length, _BLOCK_SIZE)] or [(offset, 0)]
+
+
+_etag_executor = None
+
+
+def _get_etag_executor():
+    global _etag_executor
+    if _etag_executor is None:
+        _etag_executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+    return _etag_executor
+
+
+def _file_sha1s(filePath, offset, length, executor=None):
+    ranges = _block_ranges(offset, length)
+    if len(ranges) == 1:
+        return [_block_sha1(filePath, *ranges[0])]
+    executor = executor or _get_etag_executor()
+    return list(executor.map(_block_sha1, *zip(*[(filePath, start, size) for start, size in ranges])))
+
+
+async def _file_sha1s_async(filePath, offset, length, executor=None):
+    loop = asyncio.get_event_loop()
+    return await asyncio.gather(*[
+        loop.run_in_executor(executor, _block_sha1, filePath, start, size)
+        for start, size in _block_ranges(offset, length)
+    ])
 
 
 def entry(bucket, key):
@@ -30,6 +30,9 @@ setuptools.setup(
         'loguru==0.5.3',
         'cachetools==4.2.1'
     ],
+    extras_require={
+        'zstd': ['zstandard'],
+    },
     classifiers=[
         r'Programming Language :: Python :: 3.7',
         r'License :: OSI Approved :: Apache Software License',
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""本地模拟的七牛上传、管理及列举接口，供测试使用"""
+
+import asyncio
+import contextlib
+import hashlib
+import io
+import json
+import os
+import re
+import time
+import uuid
+import zlib
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from qiniu.utils import etag_stream
+
+from async_cow import AsyncCow, config
+from async_cow.http.base import RequestBase
+from async_cow.utils import urlsafe_base64_decode
+
+
+def _bucket_of(request, form_token=None):
+    token = form_token or request.headers.get('Authorization', '').split(' ')[-1]
+    policy = json.loads(urlsafe_base64_decode(token.split(':')[2]))
+    return policy['scope'].split(':')[0]
+
+
+class FakeQiniu(object):
+    """模拟服务
+
+    Attributes:
+        objects:    (bucket, key) -> {'data', 'hash', 'fsize', 'params', 'mime_type'}
+        requests:   收到的请求 (method, path) 列表
+        ctx_ttl:    mkblk/bput返回的ctx有效期
+        peak:       同时处理中的最大请求数
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.requests = []
+        self.ctx_ttl = 7 * 24 * 3600
+        self.blocks = {}
+        self.uploads = {}
+        self._failures = []
+        self._delays = []
+        self._in_flight = 0
+        self.peak = 0
+
+        self.app = web.Application(middlewares=[self._middleware], client_max_size=1024 ** 3)
+        self.app.router.add_post('/', self.form_upload)
+        self.app.router.add_post('/mkblk/{size}', self.mkblk)
+        self.app.router.add_post('/bput/{ctx}/{offset}', self.bput)
+        self.app.router.add_post('/mkfile/{size}{rest:.*}', self.mkfile)
+        self.app.router.add_post('/buckets/{bucket}/objects/{key}/uploads', self.init_parts)
+        self.app.router.add_put('/buckets/{bucket}/objects/{key}/uploads/{upload_id}/{part}', self.upload_part)
+        self.app.router.add_post('/buckets/{bucket}/objects/{key}/uploads/{upload_id}', self.complete_parts)
+        self.app.router.add_post('/stat/{entry}', self.stat)
+        self.app.router.add_post('/delete/{entry}', self.delete)
+        self.app.router.add_post('/batch', self.batch)
+        self.app.router.add_get('/list', self.list)
+        self.app.router.add_post('/pfop', self.pfop)
+
+    def fail(self, pattern, status, times=1, after=0):
+        """路径匹配pattern的请求跳过前after个后返回status，times为None时一直失败"""
+        self._failures.append([re.compile(pattern), status, times, after])
+
+    def delay(self, pattern, seconds):
+        """路径匹配pattern的请求延迟seconds秒后处理"""
+        self._delays.append((re.compile(pattern), seconds))
+
+    def put_object(self, bucket, key, data, **extra):
+        self.objects[(bucket, key)] = dict(data=data, hash=etag_stream(io.BytesIO(data)), fsize=len(data), **extra)
+
+    def count(self, pattern):
+        return len([path for _, path in self.requests if re.search(pattern, path)])
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        self.requests.append((request.method, request.path))
+        self._in_flight += 1
+        self.peak = max(self.peak, self._in_flight)
+        try:
+            for pattern, seconds in self._delays:
+                if pattern.search(request.path):
+                    await asyncio.sleep(seconds)
+            return await self._dispatch(request, handler)
+        finally:
+            self._in_flight -= 1
+
+    async def _dispatch(self, request, handler):
+        for failure in self._failures:
+            pattern, status, times, after = failure
+            if times != 0 and pattern.search(request.path):
+                if after > 0:
+                    failure[3] -= 1
+                    continue
+                if times is not None:
+                    failure[2] -= 1
+                await request.read()
+                return self._json({'error': 'injected'}, status)
+        return await handler(request)
+
+    @staticmethod
+    def _json(body, status=200):
+        return web.json_response(body, status=status, headers={'X-Reqid': uuid.uuid4().hex})
+
+    def _store(self, bucket, key, data, params=None, mime_type=None):
+        self.put_object(bucket, key, data, params=params or {}, mime_type=mime_type)
+        obj = self.objects[(bucket, key)]
+        return self._json({'hash': obj['hash'], 'key': key, 'fsize': obj['fsize']})
+
+    async def form_upload(self, request):
+        fields = {}
+        data = None
+        reader = await request.multipart()
+        async for part in reader:
+            if part.name == 'file':
+                data = await part.read()
+            else:
+                fields[part.name] = await part.text()
+        if 'crc32' in fields and int(fields['crc32']) != zlib.crc32(data):
+            return self._json({'error': 'crc32 not match'}, 406)
+        bucket = _bucket_of(request, fields.pop('token'))
+        key = fields.pop('key', None)
+        fields.pop('crc32', None)
+        return self._store(bucket, key, bytes(data), fields)
+
+    def _ctx(self, data, chunk):
+        # crc32为本次上传分片的校验值
+        ctx = uuid.uuid4().hex
+        self.blocks[ctx] = data
+        return self._json({
+            'ctx': ctx,
+            'checksum': hashlib.sha1(data).hexdigest(),
+            'crc32': zlib.crc32(chunk),
+            'offset': len(data),
+            'host': str(self.url),
+            'expired_at': int(time.time() + self.ctx_ttl),
+        })
+
+    async def mkblk(self, request):
+        data = await request.read()
+        return self._ctx(data, data)
+
+    async def bput(self, request):
+        data = await request.read()
+        previous = self.blocks.get(request.match_info['ctx'])
+        if previous is None:
+            return self._json({'error': 'context expired'}, 701)
+        if len(previous) != int(request.match_info['offset']):
+            return self._json({'error': 'bad offset'}, 400)
+        return self._ctx(previous + data, data)
+
+    async def mkfile(self, request):
+        size = int(request.match_info['size'])
+        pieces = request.match_info['rest'].strip('/').split('/')
+        options = {k: urlsafe_base64_decode(v).decode('utf-8') for k, v in zip(pieces[0::2], pieces[1::2])}
+        body = (await request.read()).decode('utf-8')
+        contexts = [ctx for ctx in body.split(',') if ctx]
+        if any(ctx not in self.blocks for ctx in contexts):
+            return self._json({'error': 'context expired'}, 701)
+        data = b''.join(self.blocks[ctx] for ctx in contexts)
+        if len(data) != size:
+            return self._json({'error': 'size mismatch'}, 400)
+        key = options.pop('key', None)
+        options.pop('fname', None)
+        mime_type = options.pop('mimeType', None)
+        return self._store(_bucket_of(request), key, data, options, mime_type)
+
+    async def init_parts(self, request):
+        upload_id = uuid.uuid4().hex
+        self.uploads[upload_id] = {}
+        return self._json({'uploadId': upload_id, 'expireAt': int(time.time() + self.ctx_ttl)})
+
+    async def upload_part(self, request):
+        data = await request.read()
+        self.uploads[request.match_info['upload_id']][int(request.match_info['part'])] = data
+        return self._json({'etag': hashlib.md5(data).hexdigest(), 'md5': hashlib.md5(data).hexdigest()})
+
+    async def complete_parts(self, request):
+        body = await request.json()
+        parts = self.uploads.pop(request.match_info['upload_id'])
+        data = b''.join(parts[part['partNumber']] for part in body['parts'])
+        encoded_key = request.match_info['key']
+        key = None if encoded_key == '~' else urlsafe_base64_decode(encoded_key).decode('utf-8')
+        return self._store(request.match_info['bucket'], key, data, body.get('metadata'), body.get('mimeType'))
+
+    def _entry(self, entry):
+        bucket, _, key = urlsafe_base64_decode(entry).decode('utf-8').partition(':')
+        return bucket, key
+
+    def _stat(self, entry):
+        obj = self.objects.get(self._entry(entry))
+        if obj is None:
+            return 612, {'error': 'no such file or directory'}
+        return 200, {'fsize': obj['fsize'], 'hash': obj['hash'], 'mimeType': obj.get('mime_type'),
+                     'putTime': 0}
+
+    async def stat(self, request):
+        status, body = self._stat(request.match_info['entry'])
+        return self._json(body, status)
+
+    async def delete(self, request):
+        if self.objects.pop(self._entry(request.match_info['entry']), None) is None:
+            return self._json({'error': 'no such file or directory'}, 612)
+        return self._json({})
+
+    async def batch(self, request):
+        form = await request.post()
+        results = []
+        for op in form.getall('op'):
+            name, entry = op.strip('/').split('/', 1)
+            assert name == 'stat', op
+            status, body = self._stat(entry)
+            results.append({'code': status, 'data': body})
+        status = 200 if all(item['code'] == 200 for item in results) else 298
+        return self._json(results, status)
+
+    async def list(self, request):
+        query = request.query
+        bucket = query['bucket']
+        prefix = query.get('prefix', '')
+        delimiter = query.get('delimiter')
+        limit = int(query.get('limit', 1000))
+        marker = query.get('marker')
+
+        keys = sorted(key for b, key in self.objects if b == bucket and key.startswith(prefix))
+        if marker:
+            keys = [key for key in keys if key > marker]
+
+        items, prefixes, last = [], [], None
+        for key in keys:
+            if len(items) + len(prefixes) >= limit:
+                break
+            rest = key[len(prefix):]
+            if delimiter and delimiter in rest:
+                common = prefix + rest[:rest.index(delimiter) + 1]
+                if prefixes and prefixes[-1] == common:
+                    last = key
+                    continue
+                prefixes.append(common)
+            else:
+                obj = self.objects[(bucket, key)]
+                items.append({'key': key, 'hash': obj['hash'], 'fsize': obj['fsize']})
+            last = key
+
+        more = bool(keys) and last is not None and last != keys[-1]
+        body = {'items': items}
+        if prefixes:
+            body['commonPrefixes'] = prefixes
+        if more:
+            body['marker'] = last
+        return self._json(body)
+
+    async def pfop(self, request):
+        # 以签名使用的access_key作为persistentId，便于检查鉴权对象
+        await request.read()
+        access_key = request.headers.get('Authorization', '').split(' ')[-1].split(':')[0]
+        return self._json({'persistentId': access_key})
+
+
+@contextlib.asynccontextmanager
+async def fake_qiniu(**settings):
+    """启动模拟服务并返回 (服务, AsyncCow)，上传、管理及列举请求均指向模拟服务"""
+    server = FakeQiniu()
+    test_server = TestServer(server.app)
+    await test_server.start_server()
+    server.url = str(test_server.make_url('')).rstrip('/')
+
+    zone = config.get_default('default_zone')
+    saved_zone = (zone.up_host, zone.up_host_backup)
+    saved_config = dict(config._config)
+    zone.up_host = zone.up_host_backup = server.url
+    config._config['default_rs_host'] = server.url
+    config._config['default_rsf_host'] = server.url
+
+    settings.setdefault('retry_count', 1)
+    RequestBase._instance = None
+    cow = AsyncCow(settings.pop('access_key', 'ak'), settings.pop('secret_key', 'sk'), **settings)
+    try:
+        yield server, cow
+    finally:
+        await cow.release()
+        RequestBase._instance = None
+        zone.up_host, zone.up_host_backup = saved_zone
+        config._config.clear()
+        config._config.update(saved_config)
+        await test_server.close()
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class MemoryRecorder(object):
+    """保存在内存中的上传记录，写入时经过JSON序列化，与持久化的记录格式一致"""
+
+    def __init__(self):
+        self.records = {}
+
+    def get_upload_record(self, file_name, key):
+        return self.records.get((file_name, key))
+
+    def set_upload_record(self, file_name, key, data):
+        self.records[(file_name, key)] = json.loads(json.dumps(data))
+
+    def delete_upload_record(self, file_name, key):
+        self.records.pop((file_name, key), None)
+
+
+def write_file(tmp_path, size, name='big.bin'):
+    """写入size字节的随机数据，返回 (文件路径, 数据)"""
+    data = os.urandom(size)
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path), data
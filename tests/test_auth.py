@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+from qiniu import config as qiniu_config
+
+from async_cow.auth import AuthRegistry
+
+from fake_qiniu import fake_qiniu, run
+
+
+def test_registry_routes_buckets_and_rotates_keys():
+    registry = AuthRegistry()
+    old_a = registry.register('ak-a', 'sk-a', buckets=['bucket-a'])
+    registry.register('ak-b', 'sk-b', buckets=['bucket-b'], default=True)
+
+    async def main():
+        async with fake_qiniu(auth_registry=registry) as (server, cow):
+            assert cow.get_token('bucket-a', 'k').startswith('ak-a:')
+            assert cow.get_token('bucket-b', 'k').startswith('ak-b:')
+            # 未登记的空间使用默认账号
+            assert cow.get_token('other', 'k').startswith('ak-b:')
+
+            old_token = cow.get_token('bucket-a', 'k')
+            new_a = registry.rotate('ak-a', 'ak-a2', 'sk-a2')
+            assert cow.get_auth('bucket-a') is new_a
+            assert cow.get_token('bucket-a', 'k').startswith('ak-a2:')
+            # 旧鉴权对象不受影响，已签发的凭证仍然可用
+            assert old_a.get_access_key() == 'ak-a'
+            assert old_token.startswith('ak-a:')
+
+            ret, info = await cow.get_bucket('bucket-a').put_data('k', b'data')
+            assert ret is not None, info
+            assert server.objects[('bucket-a', 'k')]['data'] == b'data'
+
+    run(main())
+
+    registry.unregister('ak-b')
+    assert registry.get_auth('other') is registry.get_auth(access_key='ak-a2')
+
+
+def test_services_sign_with_registry_accounts(monkeypatch):
+    registry = AuthRegistry()
+    registry.register('ak-a', 'sk-a', buckets=['bucket-a'])
+    default = registry.register('ak-b', 'sk-b', default=True)
+
+    async def main():
+        # 与README一致，只通过auth_registry提供密钥
+        async with fake_qiniu(access_key=None, secret_key=None, auth_registry=registry) as (server, cow):
+            monkeypatch.setitem(qiniu_config._config, 'default_api_host', server.url)
+            assert cow.auth is default
+            ret, info = await cow.get_persistent_fop('bucket-a').execute('k', ['avthumb/mp4'])
+            assert ret == {'persistentId': 'ak-a'}, info
+            ret, info = await cow.get_persistent_fop('other').execute('k', ['avthumb/mp4'])
+            assert ret == {'persistentId': 'ak-b'}, info
+
+    run(main())
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+import pytest
+
+from qiniu.http import ResponseInfo
+
+from async_cow.http.base import need_retry
+from async_cow.service.storage import bulk
+
+from fake_qiniu import fake_qiniu, run
+
+
+def test_put_many_skip_identical_bounds_hashing(tmp_path, monkeypatch):
+    items = []
+    for i in range(12):
+        path = tmp_path / 'f{0}.txt'.format(i)
+        path.write_bytes(b'file %02d' % i)
+        items.append(('f{0}.txt'.format(i), str(path)))
+
+    running = []
+    peak = []
+    etag_async = bulk.etag_async
+
+    async def counting_etag(path, executor=None):
+        running.append(path)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        try:
+            return await etag_async(path, executor)
+        finally:
+            running.remove(path)
+
+    monkeypatch.setattr(bulk, 'etag_async', counting_etag)
+
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            for i in range(11):
+                server.put_object('bucket', 'f{0}.txt'.format(i), b'file %02d' % i)
+            # 大小相同内容不同，需要计算etag后上传
+            server.put_object('bucket', 'f11.txt', b'file XX')
+
+            uploads = cow.get_bucket('bucket').put_many(items, skip_identical=True, hash_workers=2)
+            results = {key: ret async for key, _, ret, _ in uploads}
+            assert sum(1 for ret in results.values() if ret.get('skipped')) == 11
+            assert server.objects[('bucket', 'f11.txt')]['data'] == b'file 11'
+            assert uploads.stats['skipped'] == 11
+            assert len(peak) == 12 and max(peak) <= 2
+
+    run(main())
+
+
+def test_put_many_retries_server_errors_and_counts_stats(tmp_path):
+    items = []
+    for i in range(10):
+        path = tmp_path / 'f{0}.txt'.format(i)
+        path.write_bytes(b'x' * (i + 1))
+        items.append(('f{0}.txt'.format(i), str(path)))
+    items.append(('missing.txt', str(tmp_path / 'missing.txt')))
+
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            server.fail(r'^/$', 503, times=2)
+            server.delay(r'^/$', 0.01)
+            uploads = cow.get_bucket('bucket').put_many(items, workers=3, retries=2, retry_delay=0.01)
+            results = {key: ret async for key, _, ret, _ in uploads}
+
+            assert results.pop('missing.txt') is None
+            assert all(ret is not None for ret in results.values())
+            for i in range(10):
+                assert server.objects[('bucket', 'f{0}.txt'.format(i))]['data'] == b'x' * (i + 1)
+            assert server.count(r'^/$') == 12
+            assert server.peak <= 3
+            stats = uploads.stats
+            assert (stats['files'], stats['failed'], stats['bytes']) == (11, 1, 55)
+
+    run(main())
+
+
+def test_put_many_does_not_retry_client_errors(tmp_path):
+    path = tmp_path / 'f.txt'
+    path.write_bytes(b'data')
+
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            server.fail(r'^/$', 401, times=None)
+            uploads = cow.get_bucket('bucket').put_many([('f.txt', str(path))], retries=3, retry_delay=0.01)
+            [(_, _, ret, info)] = [result async for result in uploads]
+            assert ret is None
+            # 仅表单上传自身换备用域名重试一次，put_many不再重试
+            assert server.count(r'^/$') == 2
+            assert uploads.stats['failed'] == 1
+
+    run(main())
+
+
+def test_put_many_raises_programming_errors_without_retry(tmp_path, monkeypatch):
+    path = tmp_path / 'f.txt'
+    path.write_bytes(b'data')
+    calls = []
+    assert not need_retry(ResponseInfo(None, TypeError('bug')))
+    assert need_retry(ResponseInfo(None, ConnectionResetError()))
+
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            bucket = cow.get_bucket('bucket')
+
+            async def broken_put_file(key, file_path, **options):
+                calls.append(key)
+                raise TypeError('bug')
+
+            monkeypatch.setattr(bucket, 'put_file', broken_put_file)
+            with pytest.raises(TypeError):
+                async for _ in bucket.put_many([('f.txt', str(path))], retries=3, retry_delay=0.01):
+                    pass
+            assert calls == ['f.txt']
+
+    run(main())
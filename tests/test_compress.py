@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import os
+
+import pytest
+
+from async_cow import config
+
+from fake_qiniu import fake_qiniu, run
+
+
+def test_put_file_gzip(tmp_path):
+    # 压缩后仍超过两个块，走分块上传
+    data = os.urandom(config._BLOCK_SIZE * 3)
+    path = tmp_path / 'app.log'
+    path.write_bytes(data)
+
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            b = cow.get_bucket('bucket')
+            ret, info = await b.put_file('app.log', str(path), compress='gzip', concurrency=2)
+            assert ret is not None, info
+            stored = server.objects[('bucket', 'app.log')]
+            assert gzip.decompress(stored['data']) == data
+            assert stored['params']['x-qn-meta-Content-Encoding'] == 'gzip'
+
+            ret, info = await b.put_data('small.json', b'{"a": 1}' * 100, compress='gzip')
+            assert ret is not None, info
+            stored = server.objects[('bucket', 'small.json')]
+            assert gzip.decompress(stored['data']) == b'{"a": 1}' * 100
+            assert stored['params']['x-qn-meta-Content-Encoding'] == 'gzip'
+
+    run(main())
+
+
+@pytest.mark.parametrize('options', [
+    {'upload_progress_recorder': object()},
+    {'keep_last_modified': True},
+    {'version': 'v2'},
+    {'use_mmap': True},
+    {'chunk_size': 1024 * 1024},
+])
+def test_put_file_compress_rejects_conflicting_options(tmp_path, options):
+    path = tmp_path / 'app.log'
+    path.write_bytes(b'log')
+
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            with pytest.raises(ValueError):
+                await cow.get_bucket('bucket').put_file('app.log', str(path), compress='gzip', **options)
+            assert server.requests == []
+
+    run(main())
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+import ast
+
+from async_cow import config
+from async_cow.service.storage.throttle import TokenBucket
+from async_cow.service.storage.throughput import ThroughputEstimator
+
+
+def test_throughput_estimator_created_lazily(monkeypatch):
+    monkeypatch.setitem(config._config, 'throughput_estimator', None)
+    estimator = config.get_default('throughput_estimator')
+    assert isinstance(estimator, ThroughputEstimator)
+    assert config.get_default('throughput_estimator') is estimator
+
+
+def test_config_does_not_import_service_layer():
+    with open(config.__file__, encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    modules = [node.module for node in tree.body if isinstance(node, ast.ImportFrom)]
+    modules += [alias.name for node in tree.body if isinstance(node, ast.Import) for alias in node.names]
+    assert not [module for module in modules if module.startswith('async_cow.service')]
+
+
+def test_upload_rate_limit_can_be_removed(monkeypatch):
+    monkeypatch.setitem(config._config, 'upload_throttle', None)
+    config.set_default(upload_rate_limit=1024)
+    throttle = config.get_default('upload_throttle')
+    assert isinstance(throttle, TokenBucket) and throttle.rate == 1024
+
+    # 未传入时不改变限速
+    config.set_default(connection_pool=10)
+    assert throttle.rate == 1024
+
+    config.set_default(upload_rate_limit=0)
+    assert config.get_default('upload_throttle') is throttle
+    assert throttle.rate is None
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+from async_cow.service.storage.content import BloomFilter, ExistenceCache
+
+from fake_qiniu import fake_qiniu, run
+
+
+def test_put_content_addressed(tmp_path):
+    path = tmp_path / 'a.jpg'
+    path.write_bytes(b'jpeg data')
+    bloom_path = str(tmp_path / 'assets.bloom')
+
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            cow.set_existence_cache('bucket', ExistenceCache(bloom=BloomFilter(bloom_path, capacity=1000)))
+            b = cow.get_bucket('bucket')
+
+            ret, info = await b.put_content_addressed(str(path), prefix='assets/')
+            assert info.ok() and not ret.get('skipped')
+            key = ret['key']
+            assert server.objects[('bucket', key)]['data'] == b'jpeg data'
+
+            # 命中进程内缓存，不发起请求，仍返回成功的ResponseInfo
+            count = len(server.requests)
+            ret, info = await b.put_content_addressed(str(path), prefix='assets/')
+            assert ret['skipped'] and ret['key'] == key
+            assert info.ok() and info.req_id is None
+            assert len(server.requests) == count
+        return key
+
+    key = run(main())
+
+    # release时写回布隆过滤器，重新加载后仍判断可能存在
+    assert key in BloomFilter(bloom_path, capacity=1000)
+    assert 'assets/other' not in BloomFilter(bloom_path, capacity=1000)
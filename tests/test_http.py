@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from qiniu.http import ResponseInfo
+
+from async_cow.http.aio import CowClientRequest, CowHttpAuthBase, HTTPClient
+
+
+class TokenAuth(CowHttpAuthBase):
+
+    def __call__(self, r):
+        r.headers['Authorization'] = 'Token ' + self.auth
+
+
+async def _serve(routes):
+    app = web.Application()
+    for path, handler in routes.items():
+        app.router.add_route('*', path, handler)
+    server = TestServer(app)
+    await server.start_server()
+    return server
+
+
+def test_auth_hook_and_result_url():
+    async def echo(request):
+        return web.json_response({'authorization': request.headers.get('Authorization')},
+                                 headers={'X-Reqid': 'req'})
+
+    async def main():
+        server = await _serve({'/echo': echo})
+        try:
+            url = str(server.make_url('/echo'))
+            # 新版本aiohttp调用update_auth时额外传入trust_env
+            result = await HTTPClient(request_class=CowClientRequest).get(url, auth=TokenAuth('abc'))
+            assert result.json()['authorization'] == 'Token abc'
+            assert result.url == url
+
+            # 新版本qiniu的ResponseInfo读取响应的url
+            info = ResponseInfo(result)
+            assert info.ok() and info.url == url
+        finally:
+            await server.close()
+
+    asyncio.run(main())
+
+
+def test_client_retries_only_server_errors():
+    counts = {}
+
+    def failing(status):
+        async def handler(request):
+            counts[status] = counts.get(status, 0) + 1
+            return web.json_response({'error': 'injected'}, status=status)
+        return handler
+
+    async def main():
+        statuses = [400, 503, 612, 701]
+        server = await _serve({'/{0}'.format(status): failing(status) for status in statuses})
+        try:
+            client = HTTPClient(retry_count=2)
+            for status in statuses:
+                try:
+                    await client.get(str(server.make_url('/{0}'.format(status))))
+                except Exception as e:
+                    assert e.status == status
+                else:
+                    raise AssertionError(status)
+        finally:
+            await server.close()
+
+    asyncio.run(main())
+    # 5xx重试，4xx及七牛6xx、7xx业务错误不重试
+    assert counts == {400: 1, 503: 2, 612: 1, 701: 1}
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+import pytest
+
+from async_cow.service.storage import listing
+
+from fake_qiniu import fake_qiniu, run
+
+
+@pytest.fixture(autouse=True)
+def no_delay(monkeypatch):
+    monkeypatch.setattr(listing, 'RETRY_DELAY', 0.01)
+
+
+def _fill(server, count, prefix='a/'):
+    for i in range(count):
+        server.put_object('bucket', '{0}{1:03d}'.format(prefix, i), b'x')
+
+
+def test_sharded_listing_retries_rate_limit():
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            _fill(server, 5, 'a/')
+            _fill(server, 5, 'b/')
+            server.fail(r'^/list', 573, times=2)
+            keys = cow.get_bucket('bucket').iter_keys_sharded(prefixes=['a/', 'b/'], page_size=2, workers=1)
+            found = [item['key'] async for item in keys]
+            assert sorted(found) == sorted(key for _, key in server.objects)
+            # 每个分片3页，另有2次频率超限的重试
+            assert server.count('^/list') == 6 + 2
+
+    run(main())
+
+
+def test_listing_fails_fast_on_client_error():
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            _fill(server, 5)
+            server.fail(r'^/list', 631, times=None)
+            keys = cow.get_bucket('bucket').iter_keys_sharded(prefixes=['a/'], retries=3)
+            with pytest.raises(IOError):
+                async for _ in keys:
+                    pass
+            assert server.count('^/list') == 1
+
+    run(main())
+
+
+def test_iter_keys_prefetches_pages_and_resumes_from_marker():
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            _fill(server, 7)
+            bucket = cow.get_bucket('bucket')
+            keys = bucket.iter_keys('a/', page_size=3)
+
+            found = [await keys.__anext__()]
+            # 使用第一页时第二页已在后台请求
+            await asyncio.sleep(0.05)
+            assert server.count('^/list') == 2
+            found += [await keys.__anext__() for _ in range(3)]
+            marker = keys.marker
+            await keys.close()
+            assert [item['key'] for item in found] == ['a/{0:03d}'.format(i) for i in range(4)]
+
+            # 从保存的marker恢复，最多重复一页
+            resumed = [item['key'] async for item in bucket.iter_keys('a/', page_size=3, marker=marker)]
+            assert resumed == ['a/{0:03d}'.format(i) for i in range(3, 7)]
+
+    run(main())
+
+
+def test_iter_keys_collects_common_prefixes():
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            for key in ['a/1', 'a/2', 'b/1', 'c', 'd']:
+                server.put_object('bucket', key, b'x')
+            keys = cow.get_bucket('bucket').iter_keys(delimiter='/', page_size=2)
+            assert [item['key'] async for item in keys] == ['c', 'd']
+            assert keys.common_prefixes == ['a/', 'b/']
+            assert keys.marker is None
+
+    run(main())
+
+
+SHARD_KEYS = ['a', 'a/1', 'a/2', 'a0', 'b', 'b/x/1', 'b/y', 'c/1', 'c0', 'z']
+
+
+@pytest.mark.parametrize('ordered', [False, True])
+def test_sharded_listing_discovers_shards_across_pages(ordered):
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            for key in SHARD_KEYS:
+                server.put_object('bucket', key, b'x')
+            # 第一层跨页返回相同的公共前缀
+            keys = cow.get_bucket('bucket').iter_keys_sharded(page_size=2, workers=2, ordered=ordered)
+            found = [item['key'] async for item in keys]
+            assert keys.shards == ['a/', 'b/', 'c/']
+            if ordered:
+                assert found == sorted(SHARD_KEYS)
+            else:
+                assert sorted(found) == sorted(SHARD_KEYS)
+
+    run(main())
+
+
+def test_ordered_sharded_listing_raises_shard_error():
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            _fill(server, 3, 'a/')
+            _fill(server, 3, 'b/')
+            server.fail(r'^/list', 631, times=None, after=1)
+            keys = cow.get_bucket('bucket').iter_keys_sharded(prefixes=['a/', 'b/'], ordered=True, page_size=3,
+                                                              workers=1)
+            with pytest.raises(IOError):
+                async for _ in keys:
+                    pass
+
+    run(main())
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+
+from async_cow import config
+from async_cow.service.storage.upload_progress_recorder import UploadProgressRecorder, AsyncUploadProgressRecorder, \
+    SqliteUploadProgressRecorder
+
+from fake_qiniu import fake_qiniu, run
+
+
+def test_async_recorder_coalesces_writes(tmp_path, monkeypatch):
+    writes = []
+    write_record = UploadProgressRecorder._write_record
+
+    def counting_write(path, data):
+        writes.append(data)
+        write_record(path, data)
+
+    monkeypatch.setattr(UploadProgressRecorder, '_write_record', staticmethod(counting_write))
+    recorder = AsyncUploadProgressRecorder(str(tmp_path), delay=0.05)
+
+    async def main():
+        for offset in range(10):
+            await recorder.set_upload_record('a.bin', 'a', {'offset': offset})
+        # 未落盘前读取到内存中的最新记录
+        assert await recorder.get_upload_record('a.bin', 'a') == {'offset': 9}
+        await asyncio.sleep(0.2)
+        assert writes == [{'offset': 9}]
+
+        await recorder.delete_upload_record('a.bin', 'a')
+        assert await recorder.get_upload_record('a.bin', 'a') is None
+
+    run(main())
+    # 原子重命名后不留下临时文件
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_failed_upload_flushes_record_immediately(tmp_path):
+    data = os.urandom(config._BLOCK_SIZE * 3)
+    path = tmp_path / 'big.bin'
+    path.write_bytes(data)
+    records = tmp_path / 'records'
+    records.mkdir()
+    recorder = AsyncUploadProgressRecorder(str(records), delay=3600)
+
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            server.fail(r'^/mkblk/', 400, after=1)
+            ret, info = await cow.put_file(cow.get_token('bucket', 'big'), 'big', str(path),
+                                           upload_progress_recorder=recorder)
+            assert ret is None
+
+    run(main())
+    record = UploadProgressRecorder(str(records)).get_upload_record('big.bin', 'big')
+    assert len(record['contexts']) == 1
+
+
+def test_sqlite_recorder_persists_and_expires(tmp_path):
+    db_path = str(tmp_path / 'records.db')
+
+    async def main():
+        recorder = SqliteUploadProgressRecorder(db_path, delay=0.01)
+        await recorder.set_upload_record('a.bin', 'a', {'offset': 1})
+        await recorder.set_upload_record('b.bin', None, {'offset': 2})
+        await recorder.close()
+
+        recorder = SqliteUploadProgressRecorder(db_path)
+        assert await recorder.get_upload_record('a.bin', 'a') == {'offset': 1}
+        assert await recorder.get_upload_record('b.bin', None) == {'offset': 2}
+        await recorder.delete_upload_record('a.bin', 'a')
+        assert await recorder.get_upload_record('a.bin', 'a') is None
+        await recorder.close()
+
+        # 超过有效期的记录不再返回
+        recorder = SqliteUploadProgressRecorder(db_path, ttl=0.05)
+        await asyncio.sleep(0.1)
+        assert await recorder.get_upload_record('b.bin', None) is None
+        await recorder.close()
+
+    run(main())
+
+
+def test_sqlite_recorder_resumes_upload(tmp_path):
+    data = os.urandom(config._BLOCK_SIZE * 3)
+    path = tmp_path / 'big.bin'
+    path.write_bytes(data)
+
+    async def main():
+        recorder = SqliteUploadProgressRecorder(str(tmp_path / 'records.db'))
+        try:
+            async with fake_qiniu() as (server, cow):
+                token = cow.get_token('bucket', 'big')
+                server.fail(r'^/mkblk/', 400, after=2)
+                ret, info = await cow.put_file(token, 'big', str(path), upload_progress_recorder=recorder)
+                assert ret is None
+
+                mkblk = server.count('^/mkblk/')
+                ret, info = await cow.put_file(token, 'big', str(path), upload_progress_recorder=recorder)
+                assert ret is not None, info
+                assert server.count('^/mkblk/') - mkblk == 1
+                assert server.objects[('bucket', 'big')]['data'] == data
+        finally:
+            await recorder.close()
+
+    run(main())
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from async_cow import config
+
+from fake_qiniu import MemoryRecorder, fake_qiniu, run, write_file
+
+
+CHUNK_SIZE = 2 * 1024 * 1024
+
+
+def test_expired_chunk_ctx_restarts_block(tmp_path):
+    path, data = write_file(tmp_path, config._BLOCK_SIZE * 2 + 1024 * 1024)
+    recorder = MemoryRecorder()
+
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            token = cow.get_token('bucket', 'big')
+
+            # 第一块完成，第二块首片mkblk成功后bput失败，上传记录中保留该块的分片进度
+            server.fail(r'^/bput/', 400, after=1)
+            ret, info = await cow.put_file(token, 'big', path, upload_progress_recorder=recorder,
+                                           chunk_size=CHUNK_SIZE)
+            assert ret is None
+            record = recorder.get_upload_record('big.bin', 'big')
+            assert len(record['contexts']) == 1
+            first = record['contexts'][0]
+            stale = record['chunks']['1']['ctx']
+
+            # 服务端丢弃该ctx，续传时bput返回701，整块重传时mkblk再失败
+            del server.blocks[stale]
+            server.fail(r'^/mkblk/', 400)
+            before = server.count('/bput/' + stale)
+            ret, info = await cow.put_file(token, 'big', path, upload_progress_recorder=recorder,
+                                           chunk_size=CHUNK_SIZE)
+            assert ret is None
+            assert server.count('/bput/' + stale) == before + 1
+            record = recorder.get_upload_record('big.bin', 'big')
+            assert 'chunks' not in record
+            assert record['contexts'] == [first]
+
+            mkblk = server.count('^/mkblk/')
+            ret, info = await cow.put_file(token, 'big', path, upload_progress_recorder=recorder,
+                                           chunk_size=CHUNK_SIZE)
+            assert ret is not None, info
+            assert server.count('^/mkblk/') - mkblk == 2
+            assert server.objects[('bucket', 'big')]['data'] == data
+            assert recorder.get_upload_record('big.bin', 'big') is None
+
+    run(main())
+
+
+def test_expired_block_is_reuploaded_alone(tmp_path):
+    path, data = write_file(tmp_path, config._BLOCK_SIZE * 2 + 1024 * 1024)
+    recorder = MemoryRecorder()
+
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            token = cow.get_token('bucket', 'big')
+
+            server.fail(r'^/mkblk/', 400, after=2)
+            ret, info = await cow.put_file(token, 'big', path, upload_progress_recorder=recorder)
+            assert ret is None
+            record = recorder.get_upload_record('big.bin', 'big')
+            assert len(record['contexts']) == 2
+
+            # 只有第一块过期，第二块仍然有效
+            record['expired_at'][0] = int(time.time())
+            mkblk = server.count('^/mkblk/')
+            ret, info = await cow.put_file(token, 'big', path, upload_progress_recorder=recorder)
+            assert ret is not None, info
+            assert server.count('^/mkblk/') - mkblk == 2
+            assert server.objects[('bucket', 'big')]['data'] == data
+
+    run(main())
+
+
+def test_fanout_skips_blocks_kept_after_gap(tmp_path):
+    path, data = write_file(tmp_path, config._BLOCK_SIZE * 2 + 1024 * 1024)
+    recorder = MemoryRecorder()
+
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            server.fail(r'^/mkblk/', 400, after=2)
+            [(ret, info)] = await cow.put_file_multi([('bucket', 'big')], path, upload_progress_recorder=recorder)
+            assert ret is None
+
+            recorder.get_upload_record('big.bin', 'bucket:big')['expired_at'][0] = int(time.time())
+            mkblk = server.count('^/mkblk/')
+            [(ret, info)] = await cow.put_file_multi([('bucket', 'big')], path, upload_progress_recorder=recorder)
+            assert ret is not None, info
+            assert server.count('^/mkblk/') - mkblk == 2
+            assert server.objects[('bucket', 'big')]['data'] == data
+
+    run(main())
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+from async_cow.service.storage import sync
+from async_cow.service.storage.sync import EtagCache
+
+from fake_qiniu import fake_qiniu, run
+
+
+def test_sync_dir(tmp_path, monkeypatch):
+    local_dir = tmp_path / 'site'
+    local_dir.mkdir()
+    for i in range(20):
+        (local_dir / 'same{0}.txt'.format(i)).write_bytes(b'same %d' % i)
+    (local_dir / 'changed.txt').write_bytes(b'new content')
+    (local_dir / 'added.txt').write_bytes(b'added')
+
+    running = []
+    peak = []
+    etag_async = sync.etag_async
+
+    async def counting_etag(path, executor=None):
+        running.append(path)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        try:
+            return await etag_async(path, executor)
+        finally:
+            running.remove(path)
+
+    monkeypatch.setattr(sync, 'etag_async', counting_etag)
+
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            for i in range(20):
+                server.put_object('bucket', 'www/same{0}.txt'.format(i), b'same %d' % i)
+            server.put_object('bucket', 'www/changed.txt', b'old content')
+            server.put_object('bucket', 'www/stale.txt', b'stale')
+
+            cache = EtagCache(str(tmp_path / 'etag.db'))
+            try:
+                result = await cow.get_bucket('bucket').sync_dir(str(local_dir), 'www/', delete=True,
+                                                                 etag_cache=cache, hash_workers=3)
+            finally:
+                await cache.close()
+
+            assert (result['uploaded'], result['skipped'], result['deleted'], result['failed']) == (2, 20, 1, [])
+            assert server.objects[('bucket', 'www/changed.txt')]['data'] == b'new content'
+            assert server.objects[('bucket', 'www/added.txt')]['data'] == b'added'
+            assert ('bucket', 'www/stale.txt') not in server.objects
+            assert len(peak) == 21 and max(peak) <= 3
+
+            # 第二次同步只有上次新增的文件需要计算etag，其余来自缓存
+            del peak[:]
+            cache = EtagCache(str(tmp_path / 'etag.db'))
+            try:
+                result = await cow.get_bucket('bucket').sync_dir(str(local_dir), 'www/', etag_cache=cache)
+            finally:
+                await cache.close()
+            assert (result['uploaded'], result['skipped']) == (0, 22)
+            assert len(peak) == 1
+
+    run(main())
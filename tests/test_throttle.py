@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+import pytest
+
+from async_cow.service.storage.throttle import TokenBucket, Throttle
+
+from fake_qiniu import fake_qiniu, run
+
+
+KB = 1024
+
+
+def test_throttle_waits_for_slowest_bucket():
+    fast = TokenBucket(1000 * KB, burst=100 * KB)
+    slow = TokenBucket(100 * KB, burst=10 * KB)
+    throttle = Throttle(fast, None, slow, TokenBucket())
+    assert throttle.limited
+    assert not Throttle(TokenBucket(), None).limited
+
+    async def main():
+        start = time.monotonic()
+        await throttle.consume(20 * KB)
+        await throttle.consume(10 * KB)
+        # 慢速桶透支20KB，以100KB/s计约0.2秒
+        return time.monotonic() - start
+
+    assert 0.15 <= run(main()) < 1
+
+
+def test_bucket_rate_limit_paces_upload_and_can_be_removed():
+    data = b'x' * (512 * KB)
+
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            b = cow.get_bucket('bucket')
+            cow.set_upload_rate_limit(2048 * KB, bucket='bucket', burst=64 * KB)
+
+            start = time.monotonic()
+            ret, info = await b.put_data('slow', data)
+            assert ret is not None, info
+            assert time.monotonic() - start >= 0.15
+
+            cow.set_upload_rate_limit(None, bucket='bucket')
+            start = time.monotonic()
+            ret, info = await b.put_data('fast', data)
+            assert ret is not None, info
+            assert time.monotonic() - start < 0.15
+            assert server.objects[('bucket', 'slow')]['data'] == data
+
+    run(main())
+
+
+def test_zero_rate_means_unlimited_at_every_level():
+    assert TokenBucket(0).reserve(KB) == 0
+    with pytest.raises(ValueError):
+        TokenBucket(-1)
+
+    async def main():
+        async with fake_qiniu(upload_rate_limit=0) as (server, cow):
+            cow.set_upload_rate_limit(0, bucket='bucket')
+            cow.set_upload_rate_limit(0, tenant='t')
+            assert not cow.get_upload_throttle('bucket', 't').limited
+            ret, info = await cow.get_bucket('bucket').put_data('k', b'x' * (256 * KB), tenant='t')
+            assert ret is not None, info
+
+    run(main())
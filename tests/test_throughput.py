@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+from async_cow import config
+from async_cow.service.storage import throughput
+from async_cow.service.storage.throughput import ThroughputEstimator
+
+from fake_qiniu import fake_qiniu, run
+
+
+MB = 1024 * 1024
+
+
+def _choose(estimator, host):
+    return estimator.choose_size(host, 4 * MB, MB, 64 * MB, MB)
+
+
+def test_part_size_follows_bandwidth_and_failures():
+    estimator = ThroughputEstimator(alpha=1)
+    assert _choose(estimator, 'new') == 4 * MB
+
+    # 100MB/s 的链路，单个分片约2秒，受最大值限制
+    estimator.observe('fast', 1024, 0.01)
+    estimator.observe('fast', 100 * MB, 1.01)
+    assert _choose(estimator, 'fast') == 64 * MB
+
+    # 1MB/s 的链路使用约2MB的分片
+    estimator.observe('slow', 4 * MB, 4)
+    assert _choose(estimator, 'slow') == 2 * MB
+
+    # 高失败率时缩小分片
+    estimator.observe('flaky', 16 * MB, 1)
+    estimator.observe('flaky', 16 * MB, 1, success=False)
+    assert _choose(estimator, 'flaky') == MB
+
+    assert [decision['host'] for decision in estimator.decisions] == ['new', 'fast', 'slow', 'flaky']
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+def test_concurrent_requests_share_bandwidth_sample(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(throughput, 'time', clock)
+    estimator = ThroughputEstimator(alpha=1)
+
+    # 4个请求同时进行，各4MB耗时4秒，合计带宽为4MB/s而不是单个请求的1MB/s
+    tokens = [estimator.begin('host') for _ in range(4)]
+    clock.now = 4
+    for token in tokens:
+        estimator.end('host', token, 4 * MB)
+    assert estimator.stats('host')['bandwidth'] == 4 * MB
+    assert estimator.stats('host')['samples'] == 4
+
+    # 受限速约束的请求只计入失败率
+    token = estimator.begin('throttled')
+    clock.now = 8
+    estimator.end('throttled', token, 4 * MB, throttled=True)
+    assert estimator.stats('throttled')['bandwidth'] is None
+    assert estimator.stats('throttled')['samples'] == 1
+
+    # 非网络原因的失败不计入统计，只有部分时间并发的请求按平均并发数折算
+    first, second = estimator.begin('mixed'), estimator.begin('mixed')
+    clock.now = 9
+    estimator.end('mixed', first, 4 * MB, success=None)
+    clock.now = 12
+    estimator.end('mixed', second, 4 * MB)
+    assert estimator.stats('mixed')['bandwidth'] == 4 * MB * 1.25 / 4
+    assert estimator.stats('mixed')['samples'] == 1
+
+
+def test_auto_part_size_uses_host_estimate(tmp_path):
+    data = b'x' * (config._BLOCK_SIZE * 2 + 1)
+    path = tmp_path / 'big.bin'
+    path.write_bytes(data)
+
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            estimator = ThroughputEstimator(alpha=1)
+            estimator.observe(server.url, 3 * MB, 1)
+            config.set_default(throughput_estimator=estimator)
+
+            ret, info = await cow.put_file(cow.get_token('bucket', 'big'), 'big', str(path), version='v2',
+                                           part_size='auto')
+            assert ret is not None, info
+            assert server.objects[('bucket', 'big')]['data'] == data
+            decision = estimator.decisions[0]
+            assert (decision['host'], decision['kind'], decision['size']) == (server.url, 'part', 6 * MB)
+            # 上传请求计入统计
+            assert estimator.stats(server.url)['samples'] > 1
+
+    run(main())
@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+
+import aiohttp
+import pytest
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from async_cow import auth, config, cow as cow_module
+from async_cow.utils import _BlockPrefetcher
+
+from fake_qiniu import MemoryRecorder, fake_qiniu, run, write_file
+
+
+PART_SIZE = 1024 * 1024
+
+
+def test_prefetch_buffers_capped_by_limit(tmp_path, monkeypatch):
+    path, data = write_file(tmp_path, config._BLOCK_SIZE * 2 + PART_SIZE * 3)
+    readers = []
+
+    class RecordingPrefetcher(_BlockPrefetcher):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            readers.append(self)
+
+    monkeypatch.setattr(auth, '_BlockPrefetcher', RecordingPrefetcher)
+
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            config.set_default(upload_buffer_limit=PART_SIZE * 3)
+            ret, info = await cow.put_file(cow.get_token('bucket', 'big'), 'big', path, version='v2',
+                                           part_size=PART_SIZE, concurrency=4)
+            assert ret is not None, info
+            assert server.objects[('bucket', 'big')]['data'] == data
+
+    run(main())
+    [reader] = readers
+    assert 0 < len(reader._buffer_ids) <= 3
+
+
+def test_blocks_upload_concurrently_and_commit_in_order(tmp_path):
+    path, data = write_file(tmp_path, config._BLOCK_SIZE * 5 + 1234)
+    progress = []
+
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            server.delay(r'^/mkblk/', 0.05)
+            ret, info = await cow.put_file(cow.get_token('bucket', 'big'), 'big', path, concurrency=3,
+                                           progress_handler=lambda uploaded, total: progress.append(uploaded))
+            assert ret is not None, info
+            assert server.objects[('bucket', 'big')]['data'] == data
+            assert ret['hash'] == server.objects[('bucket', 'big')]['hash']
+            assert 2 <= server.peak <= 3
+            assert server.count('^/mkblk/') == 6
+
+    run(main())
+    assert progress[-1] == len(data) and progress == sorted(progress)
+
+
+def test_v2_multipart_resumes_missing_parts(tmp_path):
+    path, data = write_file(tmp_path, config._BLOCK_SIZE * 2 + PART_SIZE * 2 + 100)
+    recorder = MemoryRecorder()
+
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            token = cow.get_token('bucket', 'big')
+            parts = r'/uploads/\w+/\d+$'
+
+            # 第4个分片返回4xx，不重试，已完成的3个分片记录在上传记录中
+            server.fail(parts, 400, after=3)
+            ret, info = await cow.put_file(token, 'big', path, version='v2', part_size=PART_SIZE,
+                                           upload_progress_recorder=recorder)
+            assert ret is None
+            assert server.count(parts) == 4
+            record = recorder.get_upload_record('big.bin', 'big')
+            assert [item['partNumber'] for item in record['etags']] == [1, 2, 3]
+
+            ret, info = await cow.put_file(token, 'big', path, version='v2', part_size=PART_SIZE,
+                                           upload_progress_recorder=recorder)
+            assert ret is not None, info
+            # 复用uploadId，只上传剩余的8个分片
+            assert server.count(r'/uploads$') == 1
+            assert server.count(parts) == 4 + 8
+            assert server.objects[('bucket', 'big')]['data'] == data
+
+    run(main())
+
+
+def test_v2_non_seekable_stream_is_not_recorded():
+    data = os.urandom(PART_SIZE * 3)
+    pieces = [data[i:i + 100000] for i in range(0, len(data), 100000)]
+    recorder = MemoryRecorder()
+
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            token = cow.get_token('bucket', 'pieces')
+
+            async def put():
+                return await cow.put_stream(token, 'pieces', iter(pieces), 'pieces.bin', len(data), None, None,
+                                            'application/octet-stream', None, upload_progress_recorder=recorder,
+                                            modify_time=1, version='v2', part_size=PART_SIZE)
+
+            server.fail(r'/uploads/\w+/\d+$', 400, after=1)
+            ret, info = await put()
+            assert ret is None
+            assert recorder.records == {}
+
+            # 不可seek的输入不复用已有的上传记录
+            recorder.set_upload_record('pieces.bin', 'pieces', {
+                'size': len(data), 'part_size': PART_SIZE, 'upload_id': 'stale', 'expired_at': 2 ** 40,
+                'etags': [{'partNumber': 1, 'etag': 'x'}], 'modify_time': 1,
+            })
+            ret, info = await put()
+            assert ret is not None, info
+            assert server.count(r'/uploads$') == 2
+            assert server.objects[('bucket', 'pieces')]['data'] == data
+
+    run(main())
+
+
+def test_small_put_file_reads_once_and_sends_crc(tmp_path, monkeypatch):
+    import aiofiles
+
+    path, data = write_file(tmp_path, 1024 * 100, 'small.bin')
+    opened = []
+    aiofiles_open = aiofiles.open
+
+    def counting_open(*args, **kwargs):
+        opened.append(args[0])
+        return aiofiles_open(*args, **kwargs)
+
+    monkeypatch.setattr(aiofiles, 'open', counting_open)
+
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            # 模拟服务校验表单中的crc32
+            ret, info = await cow.put_file(cow.get_token('bucket', 'small'), 'small', path, keep_last_modified=True)
+            assert ret is not None, info
+            stored = server.objects[('bucket', 'small')]
+            assert stored['data'] == data
+            assert 'x-qn-meta-!Last-Modified' in stored['params']
+
+    run(main())
+    assert opened == [path]
+
+
+def test_put_data_streams_file_objects_and_iterables(tmp_path):
+    path, data = write_file(tmp_path, config._BLOCK_SIZE * 2 + 4321)
+
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            b = cow.get_bucket('bucket')
+
+            # 超过两个块的文件对象分块上传
+            with open(path, 'rb') as f:
+                ret, info = await b.put_data('file', f)
+            assert ret is not None, info
+            assert server.objects[('bucket', 'file')]['data'] == data
+            assert server.count('^/mkblk/') == 3
+
+            # 可迭代对象读完未超过阈值时表单上传
+            ret, info = await b.put_data('small', iter([b'a' * 1000, b'b' * 1000]))
+            assert ret is not None, info
+            assert server.objects[('bucket', 'small')]['data'] == b'a' * 1000 + b'b' * 1000
+            assert server.count('^/mkblk/') == 3
+
+            # 长度未知的可迭代对象按实际读取的长度mkfile
+            pieces = [data[i:i + 100000] for i in range(0, len(data), 100000)]
+            ret, info = await b.put_data('pieces', iter(pieces))
+            assert ret is not None, info
+            assert server.objects[('bucket', 'pieces')]['data'] == data
+            assert server.count('^/mkfile/{0}/'.format(len(data))) == 2
+
+    run(main())
+
+
+def test_in_memory_data_does_not_record_progress():
+    data = os.urandom(config._BLOCK_SIZE * 2 + 4321)
+    recorder = MemoryRecorder()
+
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            token = cow.get_token('bucket', 'mem')
+            server.fail(r'^/mkblk/', 400, after=1)
+            ret, info = await cow.put_stream(token, 'mem', data, None, len(data), None, None,
+                                             'application/octet-stream', None, upload_progress_recorder=recorder)
+            assert ret is None
+            assert recorder.records == {}
+
+            # 指定modify_time时可以续传
+            server.fail(r'^/mkblk/', 400, after=1)
+            ret, info = await cow.put_stream(token, 'mem', data, 'mem.bin', len(data), None, None,
+                                             'application/octet-stream', None, upload_progress_recorder=recorder,
+                                             modify_time=1)
+            assert ret is None
+            assert len(recorder.records[('mem.bin', 'mem')]['contexts']) == 1
+
+    run(main())
+
+
+def test_put_async_iter_unknown_length():
+    data = os.urandom(config._BLOCK_SIZE * 3 + 777)
+    progress = []
+
+    async def generate():
+        # 大小不一的片段，跨越块边界
+        offset, step = 0, 1
+        while offset < len(data):
+            step = step * 3 % 1000003 + 1
+            yield data[offset:offset + step]
+            offset += step
+
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            ret, info = await cow.get_bucket('bucket').put_async_iter(
+                'stream', generate(), progress_handler=lambda uploaded, total: progress.append((uploaded, total)))
+            assert ret is not None, info
+            assert server.objects[('bucket', 'stream')]['data'] == data
+            assert server.count('^/mkblk/') == 4
+
+    run(main())
+    assert progress[-1] == (len(data), None)
+
+
+def test_put_async_iter_short_or_empty_uses_form_upload():
+    async def generate(pieces):
+        for piece in pieces:
+            yield piece
+
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            b = cow.get_bucket('bucket')
+            ret, info = await b.put_async_iter('empty', generate([]))
+            assert ret is not None, info
+            ret, info = await b.put_async_iter('short', generate([b'ab', b'', b'cd']))
+            assert ret is not None, info
+
+            assert server.objects[('bucket', 'empty')]['data'] == b''
+            assert server.objects[('bucket', 'short')]['data'] == b'abcd'
+            assert server.count('^/mkfile/') == 0
+            assert server.count('^/$') == 2
+
+    run(main())
+
+
+def test_put_stream_reader_forwards_request_body():
+    big = os.urandom(config._BLOCK_SIZE * 2 + 999)
+
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            bucket = cow.get_bucket('bucket')
+
+            async def handler(request):
+                ret, info = await bucket.put_stream_reader(request.match_info['key'], request, concurrency=2)
+                return web.json_response(ret, status=200 if ret is not None else 500)
+
+            app = web.Application(client_max_size=1024 ** 3)
+            app.router.add_put('/{key}', handler)
+            gateway = TestServer(app)
+            await gateway.start_server()
+            try:
+                async with aiohttp.ClientSession() as session:
+                    for key, body in (('big', big), ('small', b'small body')):
+                        async with session.put(gateway.make_url('/' + key), data=body) as resp:
+                            assert resp.status == 200
+                            assert server.objects[('bucket', key)]['data'] == body
+                    # 大请求体分块转发，小请求体表单上传
+                    assert server.count('^/mkblk/') == 3
+                    assert server.count('^/$') == 1
+            finally:
+                await gateway.close()
+
+    run(main())
+
+
+def test_put_file_mmap(tmp_path, monkeypatch):
+    path, data = write_file(tmp_path, config._BLOCK_SIZE * 2 + PART_SIZE + 5)
+    streams = []
+    resume_init = auth._Resume.__init__
+
+    def recording_init(self, up_token, key, input_stream, *args, **kwargs):
+        streams.append(input_stream)
+        resume_init(self, up_token, key, input_stream, *args, **kwargs)
+
+    monkeypatch.setattr(auth._Resume, '__init__', recording_init)
+
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            b = cow.get_bucket('bucket')
+            ret, info = await b.put_file('v1', path, use_mmap=True, concurrency=2)
+            assert ret is not None, info
+            assert server.objects[('bucket', 'v1')]['data'] == data
+
+            ret, info = await b.put_file('v2', path, use_mmap=True, version='v2', part_size=PART_SIZE)
+            assert ret is not None, info
+            assert server.objects[('bucket', 'v2')]['data'] == data
+
+    run(main())
+    # 文件映射后以memoryview作为输入，分块直接切片
+    assert len(streams) == 2 and all(isinstance(stream, memoryview) for stream in streams)
+
+
+def test_put_file_multi_reads_source_once(tmp_path, monkeypatch):
+    path, data = write_file(tmp_path, config._BLOCK_SIZE * 3 + 4321)
+    reads = []
+    async_reader = cow_module._async_reader
+
+    class CountingReader(object):
+
+        def __init__(self, stream):
+            self._stream = stream
+
+        async def read(self, size=-1):
+            chunk = await self._stream.read(size)
+            reads.append(len(chunk))
+            return chunk
+
+        async def seek(self, *args):
+            return await self._stream.seek(*args)
+
+    monkeypatch.setattr(cow_module, '_async_reader', lambda stream: CountingReader(async_reader(stream)))
+
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            results = await cow.put_file_multi([('a', 'big'), ('b', 'copy')], path, concurrency=2)
+            assert all(ret is not None for ret, _ in results), results
+            assert server.objects[('a', 'big')]['data'] == data
+            assert server.objects[('b', 'copy')]['data'] == data
+            assert server.count('^/mkblk/') == 2 * 4
+
+    run(main())
+    assert sum(reads) == len(data)
+
+
+def test_put_file_multi_isolates_network_errors_only(tmp_path, monkeypatch):
+    path, data = write_file(tmp_path, 1024, 'small.bin')
+    cancelled = []
+
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            form_put = cow._form_put
+
+            async def failing_put(token, key, *args, **kwargs):
+                if key == 'broken':
+                    raise aiohttp.ClientConnectionError('connection reset')
+                if key == 'bug':
+                    raise TypeError('bug')
+                try:
+                    await asyncio.sleep(0.2)
+                except asyncio.CancelledError:
+                    cancelled.append(key)
+                    raise
+                return await form_put(token, key, *args, **kwargs)
+
+            monkeypatch.setattr(cow, '_form_put', failing_put)
+
+            [(ret, info), (broken, broken_info)] = await cow.put_file_multi([('a', 'ok'), ('b', 'broken')], path)
+            assert ret is not None, info
+            assert broken is None and isinstance(broken_info.exception, aiohttp.ClientConnectionError)
+            assert server.objects[('a', 'ok')]['data'] == data
+
+            with pytest.raises(TypeError):
+                await cow.put_file_multi([('a', 'slow'), ('b', 'bug')], path)
+            await asyncio.sleep(0)
+            assert cancelled == ['slow']
+            assert ('a', 'slow') not in server.objects
+
+    run(main())
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import zlib
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from qiniu.utils import etag_stream
+
+from async_cow import config
+from async_cow.service.storage.sync import EtagCache
+from async_cow.utils import crc32_async, etag, etag_async, etag_v2, etag_v2_async
+
+from fake_qiniu import fake_qiniu, run
+
+
+class RecordingExecutor(ThreadPoolExecutor):
+
+    def __init__(self):
+        super().__init__(max_workers=1)
+        self.calls = 0
+
+    def submit(self, *args, **kwargs):
+        self.calls += 1
+        return super().submit(*args, **kwargs)
+
+
+def test_crc32_async_offloads_large_data():
+    executor = RecordingExecutor()
+    data = bytes(range(256)) * 1024
+
+    async def main():
+        assert await crc32_async(b'small', executor, inline_threshold=1024) == zlib.crc32(b'small')
+        assert executor.calls == 0
+        assert await crc32_async(memoryview(data), executor, inline_threshold=1024) == zlib.crc32(data)
+        assert executor.calls == 1
+
+    try:
+        run(main())
+    finally:
+        executor.shutdown()
+
+
+def test_form_upload_checksum_uses_configured_executor():
+    executor = RecordingExecutor()
+
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            config.set_default(checksum_executor=executor, checksum_inline_threshold=0)
+            # 模拟服务校验表单中的crc32
+            ret, info = await cow.get_bucket('bucket').put_data('k', b'payload' * 1000)
+            assert ret is not None, info
+            assert executor.calls == 1
+
+    try:
+        run(main())
+    finally:
+        executor.shutdown()
+
+
+MB = 1024 * 1024
+
+ETAG_SIZES = [0, 1, config._BLOCK_SIZE - 1, config._BLOCK_SIZE, config._BLOCK_SIZE + 1,
+              config._BLOCK_SIZE * 2 + 12345]
+
+
+@pytest.mark.parametrize('size', ETAG_SIZES)
+def test_etag_matches_qiniu_etag_stream(tmp_path, size):
+    data = os.urandom(size)
+    path = tmp_path / 'f.bin'
+    path.write_bytes(data)
+    expected = etag_stream(io.BytesIO(data))
+    executor = RecordingExecutor()
+
+    try:
+        assert etag(str(path)) == expected
+        assert run(etag_async(str(path), executor)) == expected
+        assert executor.calls == max(1, -(-size // config._BLOCK_SIZE))
+    finally:
+        executor.shutdown()
+
+
+def _pattern(size):
+    return (bytes(range(251)) * (size // 251 + 1))[:size]
+
+
+# 按七牛公布的算法独立计算的结果
+@pytest.mark.parametrize('size, part_size, expected', [
+    (config._BLOCK_SIZE * 2 + 1, config._BLOCK_SIZE, 'lpRzEFZm74e2PCP5AZHpXD7HEH-Z'),
+    (MB, 3 * MB, 'FsL8TLIPEwGmsN0hHBnmmhOSXb5A'),
+    (config._BLOCK_SIZE * 2 + 1, 3 * MB, 'nm15IjvUuyI5zYpKL69U-arjA7UZ'),
+    (config._BLOCK_SIZE * 2 + 1, 5 * MB, 'nq0p2Woe2z7SINMoXLwHkj2bnL2g'),
+])
+def test_etag_v2_matches_known_digests(tmp_path, size, part_size, expected):
+    path = tmp_path / 'f.bin'
+    path.write_bytes(_pattern(size))
+
+    assert etag_v2(str(path), part_size) == expected
+    assert run(etag_v2_async(str(path), part_size)) == expected
+
+
+def test_hashing_paths_use_configured_executor(tmp_path):
+    executor = RecordingExecutor()
+    local_dir = tmp_path / 'site'
+    local_dir.mkdir()
+    (local_dir / 'a.txt').write_bytes(b'aaa')
+    other = tmp_path / 'b.txt'
+    other.write_bytes(b'bbb')
+
+    async def main():
+        async with fake_qiniu() as (server, cow):
+            config.set_default(checksum_executor=executor)
+            b = cow.get_bucket('bucket')
+            server.put_object('bucket', 'a.txt', b'xxx')
+            server.put_object('bucket', 'b.txt', b'xxx')
+
+            await b.sync_dir(str(local_dir), etag_cache=EtagCache(str(tmp_path / 'etag.db')))
+            assert executor.calls == 1
+            async for _ in b.put_many([('b.txt', str(other))], skip_identical=True):
+                pass
+            assert executor.calls == 2
+            await b.put_content_addressed(str(other))
+            assert executor.calls == 3
+
+    try:
+        run(main())
+    finally:
+        executor.shutdown()